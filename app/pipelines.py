@@ -0,0 +1,285 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from core.executors import executors
+from core.jobs import Progress
+from core.result_cache import result_cache
+from utils import pdf_reader
+from utils.all_text_analyzer import AllTextAnalyzer
+from utils.content_analyzer import ContentAnalyzer
+from utils.image_analyzer import ImageAnalyzer
+from utils.rag_analyzer import chunk_text, rag_analyzer
+
+
+def _filter_slides_by_flags(slides_text, first_slide: bool, last_slide: bool):
+    if not slides_text:
+        return [], []
+
+    first_num = slides_text[0]['slide_number']
+    last_num = slides_text[-1]['slide_number']
+
+    excluded = set()
+    if not first_slide:
+        excluded.add(first_num)
+    if not last_slide:
+        excluded.add(last_num)
+
+    included = [s for s in slides_text if s['slide_number'] not in excluded]
+    return included, sorted(list(excluded))
+
+def _build_full_text(included_slides: List[Dict]) -> str:
+    full_text_blocks = []
+    for slide in included_slides:
+        idx = slide.get("slide_number", "?")
+        text = slide.get("text", "").strip()
+        full_text_blocks.append(f"--- SLIDE {idx} ---\n{text}")
+    return "\n\n".join(full_text_blocks)
+
+def _build_rag_chunks(included_slides: List[Dict]) -> List[str]:
+    chunks = []
+    for slide in included_slides:
+        chunks.extend(chunk_text(slide.get("text", "")))
+    return chunks
+
+async def _get_cached_report(cache_key: str):
+    return await executors.run_io(result_cache.get, cache_key)
+
+async def _cache_report(cache_key: str, payload: dict):
+    # Fallback-отчёты и отчёты с блоками или подписями-заглушками обычно вызваны временными сбоями
+    # модели — их не кэшируем, чтобы следующий запрос повторил упавшие вызовы
+    report = payload.get("report", {})
+    if (report.get("final_verdict") == "Fallback" or report.get("degraded")
+            or report.get("degraded_blocks") or report.get("degraded_captions")):
+        return
+    await executors.run_io(result_cache.set, cache_key, payload)
+
+async def _slides_text(pdf_path: str, slides_text: Optional[List[Dict]]) -> List[Dict]:
+    if slides_text is not None:
+        return slides_text
+    return await executors.run_io(pdf_reader.extract_text_by_slides, pdf_path)
+
+async def _stage(progress: Optional[Progress], stage: str, state: str):
+    if progress is not None:
+        await progress(stage, state)
+
+def _scoped(progress: Optional[Progress], section: str) -> Optional[Progress]:
+    if progress is None:
+        return None
+
+    async def scoped(stage: str, state: str):
+        await progress(f"{section}.{stage}", state)
+    return scoped
+
+
+def _structure_cache_key(file_hash: str, model_name: str, use_rag: bool, user_context: Optional[str],
+                         first_slide: bool, last_slide: bool, max_tokens: int, temperature: float) -> str:
+    return result_cache.make_key(
+        "structure", file_hash, model_name=model_name, use_rag=use_rag, user_context=user_context,
+        first_slide=first_slide, last_slide=last_slide, max_tokens=max_tokens, temperature=temperature
+    )
+
+async def _prepare_structure_input(pdf_path: str, use_rag: bool, user_context: Optional[str],
+                                   first_slide: bool, last_slide: bool, slides_text: Optional[List[Dict]],
+                                   progress: Optional[Progress]):
+    await _stage(progress, "parse", "running")
+    slides_text = await _slides_text(pdf_path, slides_text)
+    included_slides, excluded_slide_numbers = _filter_slides_by_flags(slides_text, first_slide, last_slide)
+    full_text = _build_full_text(included_slides)
+    rag_output = "rag-система не использовалась"
+    await _stage(progress, "parse", "done")
+
+    if use_rag and user_context:
+        await _stage(progress, "rag", "running")
+        # оба поиска идут параллельно: их эмбеддинги склеиваются микробатчером в общие батчи
+        relevant_docs, rag_output = await asyncio.gather(
+            executors.run_io(rag_analyzer.query, user_context, 3),
+            executors.run_io(rag_analyzer.query_chunks, _build_rag_chunks(included_slides), 3),
+        )
+        context_text = "\n".join([d["text"] for d in relevant_docs])
+        prompt_with_context = f"{context_text}\n\n{full_text}"
+        await _stage(progress, "rag", "done")
+    else:
+        prompt_with_context = full_text
+
+    return slides_text, excluded_slide_numbers, prompt_with_context, rag_output
+
+
+async def run_structure(pdf_path: str, file_hash: str, model_name: str, use_rag: bool, user_context: Optional[str],
+                        first_slide: bool, last_slide: bool, max_tokens: int, temperature: float,
+                        slides_text: Optional[List[Dict]] = None,
+                        progress: Optional[Progress] = None) -> Dict[str, Any]:
+    cache_key = _structure_cache_key(
+        file_hash, model_name, use_rag, user_context, first_slide, last_slide, max_tokens, temperature
+    )
+    cached = await _get_cached_report(cache_key)
+    if cached is not None:
+        await _stage(progress, "cache", "hit")
+        return cached
+
+    slides_text, excluded_slide_numbers, prompt_with_context, rag_output = await _prepare_structure_input(
+        pdf_path, use_rag, user_context, first_slide, last_slide, slides_text, progress
+    )
+
+    await _stage(progress, "llm", "running")
+    all_text_analyzer = AllTextAnalyzer(model_name=model_name, max_tokens=max_tokens, temperature=temperature)
+    await all_text_analyzer.initialize_models()
+    result = await all_text_analyzer.analyze_full_text(prompt_with_context)
+    await _stage(progress, "llm", "done")
+
+    payload = {
+        "total_slides": len(slides_text),
+        "excluded_slides": excluded_slide_numbers,
+        "report": result,
+        "rag_info": rag_output
+    }
+    await _cache_report(cache_key, payload)
+    return payload
+
+
+async def stream_structure(pdf_path: str, file_hash: str, model_name: str, use_rag: bool,
+                           user_context: Optional[str], first_slide: bool, last_slide: bool, max_tokens: int,
+                           temperature: float) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Потоковый вариант run_structure: отдаёт ("block", ...) по мере ответа модели на каждый блок
+    и завершает событием ("summary", payload) с тем же содержимым, что и обычный эндпоинт.
+    """
+    cache_key = _structure_cache_key(
+        file_hash, model_name, use_rag, user_context, first_slide, last_slide, max_tokens, temperature
+    )
+    cached = await _get_cached_report(cache_key)
+    if cached is not None:
+        yield "summary", cached
+        return
+
+    slides_text, excluded_slide_numbers, prompt_with_context, rag_output = await _prepare_structure_input(
+        pdf_path, use_rag, user_context, first_slide, last_slide, None, None
+    )
+
+    all_text_analyzer = AllTextAnalyzer(model_name=model_name, max_tokens=max_tokens, temperature=temperature)
+    await all_text_analyzer.initialize_models()
+    async for event, data in all_text_analyzer.iter_block_results(prompt_with_context):
+        if event == "block":
+            yield event, data
+            continue
+        payload = {
+            "total_slides": len(slides_text),
+            "excluded_slides": excluded_slide_numbers,
+            "report": data,
+            "rag_info": rag_output
+        }
+        await _cache_report(cache_key, payload)
+        yield "summary", payload
+
+
+async def run_content(pdf_path: str, file_hash: str, model_name: str, first_slide: bool, last_slide: bool,
+                      max_tokens: int, temperature: float,
+                      slides_text: Optional[List[Dict]] = None,
+                      progress: Optional[Progress] = None) -> Dict[str, Any]:
+    cache_key = result_cache.make_key(
+        "content", file_hash, model_name=model_name,
+        first_slide=first_slide, last_slide=last_slide, max_tokens=max_tokens, temperature=temperature
+    )
+    cached = await _get_cached_report(cache_key)
+    if cached is not None:
+        await _stage(progress, "cache", "hit")
+        return cached
+
+    await _stage(progress, "parse", "running")
+    slides_text = await _slides_text(pdf_path, slides_text)
+    included_slides, excluded_slide_numbers = _filter_slides_by_flags(slides_text, first_slide, last_slide)
+    full_text = _build_full_text(included_slides)
+    await _stage(progress, "parse", "done")
+
+    await _stage(progress, "llm", "running")
+    content_analyzer = ContentAnalyzer(model_name=model_name, max_tokens=max_tokens, temperature=temperature)
+    await content_analyzer.initialize_models()
+    analysis = await content_analyzer.analyze_full_content(full_text)
+    await _stage(progress, "llm", "done")
+
+    payload = {
+        "total_slides": len(slides_text),
+        "excluded_slides": excluded_slide_numbers,
+        "report": analysis
+    }
+    await _cache_report(cache_key, payload)
+    return payload
+
+
+async def run_visual(pdf_path: str, file_hash: str, model_name: str,
+                     slides_text: Optional[List[Dict]] = None,
+                     progress: Optional[Progress] = None) -> Dict[str, Any]:
+    cache_key = result_cache.make_key("visual", file_hash, model_name=model_name)
+    cached = await _get_cached_report(cache_key)
+    if cached is not None:
+        await _stage(progress, "cache", "hit")
+        return cached
+
+    total_slides = await executors.run_io(pdf_reader.page_count, pdf_path)
+    try:
+        # метрики вёрстки из векторных данных PDF; растровая плотность — только для сканов
+        slide_stats = await executors.run_cpu(pdf_reader.slide_visual_stats, pdf_path)
+    except Exception as e:
+        print(f"[pipelines] slide layout metrics failed: {e}")
+        slide_stats = None
+
+    await _stage(progress, "vlm", "running")
+    image_analyzer = ImageAnalyzer(model_name=model_name)
+    await image_analyzer.initialize_models()
+    slides_text = await _slides_text(pdf_path, slides_text)
+    result = await image_analyzer.analyze_visual_presentation(
+        pdf_reader.iter_slide_images(pdf_path), slide_stats, [slide['text'] for slide in slides_text]
+    )
+    await _stage(progress, "vlm", "done")
+
+    result['strengths'] = result.pop('visual_strengths')
+    result['weaknesses'] = result.pop('visual_weaknesses')
+
+    payload = {
+        "total_slides": total_slides,
+        "report": result
+    }
+    await _cache_report(cache_key, payload)
+    return payload
+
+
+async def _timed_section(coro) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        result = await coro
+        section = {"status": "ok", "result": result}
+    except Exception as e:
+        print(f"[pipelines] section failed: {e}")
+        section = {"status": "error", "error": str(e)}
+    section["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return section
+
+
+async def run_full(pdf_path: str, file_hash: str, llm_model_name: str, vlm_model_name: str, use_rag: bool,
+                   user_context: Optional[str], first_slide: bool, last_slide: bool, max_tokens: int,
+                   temperature: float, progress: Optional[Progress] = None) -> Dict[str, Any]:
+    """
+    Единый анализ: PDF разбирается один раз, структура, содержание и визуал считаются параллельно.
+    Ошибка одного раздела не роняет остальные — он возвращается со статусом error.
+    """
+    started = time.perf_counter()
+    await _stage(progress, "parse", "running")
+    slides_text = await executors.run_io(pdf_reader.extract_text_by_slides, pdf_path)
+    await _stage(progress, "parse", "done")
+
+    structure, content, visual = await asyncio.gather(
+        _timed_section(run_structure(pdf_path, file_hash, llm_model_name, use_rag, user_context,
+                                     first_slide, last_slide, max_tokens, temperature, slides_text=slides_text,
+                                     progress=_scoped(progress, "structure"))),
+        _timed_section(run_content(pdf_path, file_hash, llm_model_name, first_slide, last_slide,
+                                   max_tokens, temperature, slides_text=slides_text,
+                                   progress=_scoped(progress, "content"))),
+        _timed_section(run_visual(pdf_path, file_hash, vlm_model_name, slides_text=slides_text,
+                                  progress=_scoped(progress, "visual"))),
+    )
+
+    return {
+        "total_slides": len(slides_text),
+        "sections": {"structure": structure, "content": content, "visual": visual},
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
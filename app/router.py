@@ -1,40 +1,76 @@
-from typing import List
+import asyncio
+import json
+import tempfile
+from functools import partial
+from typing import IO, AsyncIterator, Awaitable, Callable, List
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Query
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, status, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 
+from app import pipelines
 from app.schemas import AddDocumentsRequest
-from utils import pdf_reader
-from utils.all_text_analyzer import AllTextAnalyzer
-from utils.content_analyzer import ContentAnalyzer
-from utils.image_analyzer import ImageAnalyzer
-from utils.rag_analyzer import rag_analyzer
-from core.config import get_llm_models_list, get_vlm_models_list
-import os
-import asyncio
+from utils import embedding, pdf_reader, reranker
+from utils.all_text_analyzer import block_cache
+from utils.image_analyzer import caption_cache, encoded_image_cache
+from utils.embedding_cache import embedding_cache
+from utils.rag_analyzer import iter_ndjson_documents, rag_analyzer
+from core.config import get_embedder_preload, get_llm_models_list, get_max_ingest_bytes, get_vlm_models_list
+from core.executors import executors
+from core.inference_clients import inference_clients
+from core.jobs import job_manager
+from core.process_stats import process_stats, process_uptime
+from core.result_cache import result_cache
 
 router = APIRouter(prefix="/api", tags=["Анализатор презентаций"])
 
+startup_info = {"startup_seconds": None}
+_background_tasks = set()
+
 
 @router.on_event("startup")
 async def startup_event():
-    rag_analyzer.initialize()
-
-def _filter_slides_by_flags(slides_text, first_slide: bool, last_slide: bool):
-    if not slides_text:
-        return [], []
+    executors.start()
+    model_names = [m['model_name'] for m in get_llm_models_list() + get_vlm_models_list()]
+    inference_clients.initialize(model_names)
+    await job_manager.start()
+    await executors.run_io(rag_analyzer.initialize)
+    if get_embedder_preload():
+        # прогрев в фоне: сервер начинает принимать запросы, не дожидаясь загрузки модели
+        task = asyncio.create_task(executors.run_io(embedding.warm_up))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    startup_info["startup_seconds"] = process_uptime()
+
+
+@router.on_event("shutdown")
+async def shutdown_event():
+    await job_manager.shutdown()
+    embedding_cache.flush()
+    executors.shutdown()
+
+
+def _find_model_name(models, model_id: int):
+    for model in models:
+        if model.get('id') == model_id: return model.get('model_name')
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Модель не найдена')
 
-    first_num = slides_text[0]['slide_number']
-    last_num = slides_text[-1]['slide_number']
+def _check_pdf(file: UploadFile):
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
-    excluded = set()
-    if not first_slide:
-        excluded.add(first_num)
-    if not last_slide:
-        excluded.add(last_num)
+async def _submit_job(kind: str, filename: str, pdf_path: str, run: Callable[..., Awaitable[dict]]) -> dict:
+    """
+    Ставит анализ в очередь. Временный PDF переходит во владение задачи и удаляется после её завершения.
+    """
+    async def job_run(progress):
+        return {"filename": filename, **await run(progress=progress)}
 
-    included = [s for s in slides_text if s['slide_number'] not in excluded]
-    return included, sorted(list(excluded))
+    job_id = await job_manager.submit(
+        kind, job_run, cleanup=lambda: pdf_reader.remove_temp_pdf(pdf_path), meta={"filename": filename}
+    )
+    return {"job_id": job_id, "status": "queued"}
 
 @router.get('/models_llm',
             summary='Все LLM-модели',
@@ -64,6 +100,41 @@ async def get_llm_model(model_id : int, models = Depends(get_all_llm_models)):
         if model.get('id') == model_id : return model
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Указанной llm-модели не существует")
 
+@router.get('/health',
+            summary='Состояние сервиса',
+            description='Готовность эмбеддера RAG, время старта и потребление памяти процессом')
+async def get_health() -> dict:
+    return {
+        "status": "ok",
+        **startup_info,
+        **process_stats(),
+        "embedder": embedding.embedder_status()
+    }
+
+@router.get('/executors',
+            summary='Состояние пулов',
+            description='Загрузка пулов потоков/процессов, выполняющих блокирующие стадии анализа')
+async def get_executors_stats() -> dict:
+    stats = executors.stats()
+    stats["inference"] = inference_clients.stats()
+    stats["result_cache"] = result_cache.stats()
+    stats["structure_block_cache"] = block_cache.stats()
+    stats["slide_caption_cache"] = caption_cache.stats()
+    stats["encoded_image_cache"] = encoded_image_cache.stats()
+    stats["embedding_batcher"] = embedding.query_batcher.stats()
+    stats["embedding_cache"] = embedding_cache.stats()
+    stats["reranker"] = reranker.reranker_stats()
+    return stats
+
+@router.get('/jobs/{job_id}',
+            summary='Статус задачи',
+            description='Статус фоновой задачи анализа, прогресс по стадиям и итоговый отчёт')
+async def get_job(job_id: str) -> dict:
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Задача не найдена')
+    return job
+
 @router.post('/analyze/structure',
              summary='Структурный анализ',
              description='Анализируется количество текста, удобочитаемость, последовательность изложения и т.п.')
@@ -76,56 +147,85 @@ async def analyze_presentation(
     last_slide: bool = Query(True, description='Включение последнего слайда в анализ'),
     max_tokens: int = Query(2000, gt=300, le=2000, description='Максимальное количество токенов для одного ответа'),
     temperature: float = Query(0.0, ge=0.0, lt=1.0, description='Параметр степени случайности/креативности ответа'),
+    as_job: bool = Query(False, description='Поставить анализ в очередь и сразу вернуть ID задачи'),
     models = Depends(get_all_llm_models)
 ) -> dict:
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-
-    model_name = None
-    for model in models:
-        if model.get('id') == model_id : model_name = model.get('model_name')
-    if not model_name:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Модель не найдена')
+    _check_pdf(file)
+    model_name = _find_model_name(models, model_id)
 
+    pdf_path = None
     try:
-        pdf_path = pdf_reader.save_temp_pdf(file)
-        slides_text = pdf_reader.extract_text_by_slides(pdf_path)
-
-        included_slides, excluded_slide_numbers = _filter_slides_by_flags(slides_text, first_slide, last_slide)
-
-        full_text_blocks = []
-        for slide in included_slides:
-            idx = slide.get("slide_number", "?")
-            text = slide.get("text", "").strip()
-            full_text_blocks.append(f"--- SLIDE {idx} ---\n{text}")
-
-        full_text = "\n\n".join(full_text_blocks)
-        rag_output = "rag-система не использовалась"
-
-        if use_rag and user_context:
-            relevant_docs = rag_analyzer.query(user_context, top_k=3)
-            context_text = "\n".join([d["text"] for d in relevant_docs])
-            prompt_with_context = f"{context_text}\n\n{full_text}"
-            rag_output = rag_analyzer.query(prompt_with_context)
-        else:
-            prompt_with_context = full_text
-
-        all_text_analyzer = AllTextAnalyzer(model_name=model_name, max_tokens=max_tokens, temperature=temperature)
-        await all_text_analyzer.initialize_models()
-        result = all_text_analyzer.analyze_full_text(prompt_with_context)
+        pdf_path, file_hash = await executors.run_io(pdf_reader.save_temp_pdf, file)
+        run = partial(
+            pipelines.run_structure,
+            pdf_path, file_hash, model_name, use_rag, user_context, first_slide, last_slide, max_tokens, temperature
+        )
+        if as_job:
+            job = await _submit_job("structure", file.filename, pdf_path, run)
+            pdf_path = None
+            return job
+        payload = await run()
+        return {"filename": file.filename, **payload}
+
+    except pdf_reader.PDFTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    finally:
+        if pdf_path:
+            pdf_reader.remove_temp_pdf(pdf_path)
 
-        os.unlink(pdf_path)
 
-        return {
-            "filename": file.filename,
-            "total_slides": len(slides_text),
-            "excluded_slides": excluded_slide_numbers,
-            "report": result,
-            "rag_info": rag_output
-        }
+@router.post('/analyze/structure/stream',
+             summary='Структурный анализ (потоковый)',
+             description='Server-sent events: событие block с JSON каждого блока слайдов сразу после ответа модели, '
+                         'затем summary с итоговым отчётом (как у /analyze/structure)')
+async def analyze_presentation_stream(
+    file : UploadFile = File(..., description='Загрузите презентацию в формате PDF'),
+    model_id: int = Query(1, description='ID LLM-модели'),
+    use_rag: bool = Query(False, description='Использование RAG-системы'),
+    user_context: str = Query(None, max_length=255, description='Контекст для RAG (промт)'),
+    first_slide: bool = Query(True, description='Включение первого слайда в анализ'),
+    last_slide: bool = Query(True, description='Включение последнего слайда в анализ'),
+    max_tokens: int = Query(2000, gt=300, le=2000, description='Максимальное количество токенов для одного ответа'),
+    temperature: float = Query(0.0, ge=0.0, lt=1.0, description='Параметр степени случайности/креативности ответа'),
+    models = Depends(get_all_llm_models)
+) -> StreamingResponse:
+    _check_pdf(file)
+    model_name = _find_model_name(models, model_id)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    # Файл сохраняем до начала ответа: UploadFile закрывается, когда обработчик вернёт StreamingResponse
+    try:
+        pdf_path, file_hash = await executors.run_io(pdf_reader.save_temp_pdf, file)
+    except pdf_reader.PDFTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    filename = file.filename
+
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def event_stream():
+        try:
+            async for event, data in pipelines.stream_structure(
+                pdf_path, file_hash, model_name, use_rag, user_context, first_slide, last_slide, max_tokens, temperature
+            ):
+                if event == "summary":
+                    data = {"filename": filename, **data}
+                yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {"detail": f"Analysis failed: {e}"})
+        finally:
+            pdf_reader.remove_temp_pdf(pdf_path)
+
+    # finally генератора не выполнится, если клиент отключится до начала итерации, поэтому
+    # файл удаляется ещё и фоновой задачей ответа (повторное удаление безопасно)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(pdf_reader.remove_temp_pdf, pdf_path)
+    )
 
 
 @router.post("/analyze/content",
@@ -138,46 +238,33 @@ async def analyze_content(
     last_slide: bool = Query(True, description='Включение последнего слайда в анализ'),
     max_tokens: int = Query(2000, gt=300, le=2000, description='Максимальное количество токенов для одного ответа'),
     temperature: float = Query(0.0, ge=0.0, lt=1.0, description='Параметр степени случайности/креативности ответа'),
+    as_job: bool = Query(False, description='Поставить анализ в очередь и сразу вернуть ID задачи'),
     models = Depends(get_all_llm_models)
 ) -> dict:
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-
-    model_name = None
-    for model in models:
-        if model.get('id') == model_id : model_name = model.get('model_name')
-    if not model_name:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Модель не найдена')
+    _check_pdf(file)
+    model_name = _find_model_name(models, model_id)
 
+    pdf_path = None
     try:
-        pdf_path = pdf_reader.save_temp_pdf(file)
-        slides_text = pdf_reader.extract_text_by_slides(pdf_path)
-
-        included_slides, excluded_slide_numbers = _filter_slides_by_flags(slides_text, first_slide, last_slide)
-
-        full_text_blocks = []
-        for slide in included_slides:
-            idx = slide.get("slide_number", "?")
-            text = slide.get("text", "").strip()
-            full_text_blocks.append(f"--- SLIDE {idx} ---\n{text}")
-
-        full_text = "\n\n".join(full_text_blocks)
-
-        content_analyzer = ContentAnalyzer(model_name=model_name, max_tokens=max_tokens, temperature=temperature)
-        await content_analyzer.initialize_models()
-        analysis = content_analyzer.analyze_full_content(full_text)
-
-        os.unlink(pdf_path)
-
-        return {
-            "filename": file.filename,
-            "total_slides": len(slides_text),
-            "excluded_slides": excluded_slide_numbers,
-            "report": analysis
-        }
-
+        pdf_path, file_hash = await executors.run_io(pdf_reader.save_temp_pdf, file)
+        run = partial(
+            pipelines.run_content,
+            pdf_path, file_hash, model_name, first_slide, last_slide, max_tokens, temperature
+        )
+        if as_job:
+            job = await _submit_job("content", file.filename, pdf_path, run)
+            pdf_path = None
+            return job
+        payload = await run()
+        return {"filename": file.filename, **payload}
+
+    except pdf_reader.PDFTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Content analysis failed: {e}")
+    finally:
+        if pdf_path:
+            pdf_reader.remove_temp_pdf(pdf_path)
 
 @router.post("/analyze/visual",
              summary='Визуальный анализ',
@@ -185,57 +272,164 @@ async def analyze_content(
 async def analyze_visual(
         file: UploadFile = File(...),
         model_id: int = Query(1, description='ID VLM-модели'),
+        as_job: bool = Query(False, description='Поставить анализ в очередь и сразу вернуть ID задачи'),
         models = Depends(get_all_vlm_models)
 ) -> dict:
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    _check_pdf(file)
+    model_name = _find_model_name(models, model_id)
 
+    pdf_path = None
     try:
-        pdf_path = pdf_reader.save_temp_pdf(file)
-
-        slide_images = pdf_reader.pdf_to_images(pdf_path)
-
-        model_name = None
-        for model in models:
-            if model.get('id') == model_id: model_name = model.get('model_name')
-        if not model_name:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Модель не найдена')
-
-        image_analyzer = ImageAnalyzer(model_name=model_name)
-        await image_analyzer.initialize_models()
-        result = await image_analyzer.analyze_visual_presentation(slide_images)
-
-        result['strengths'] = result.pop('visual_strengths')
-        result['weaknesses'] = result.pop('visual_weaknesses')
-
-        os.unlink(pdf_path)
-
-        return {
-            "filename": file.filename,
-            "total_slides": len(slide_images),
-            "report": result
-        }
-
+        pdf_path, file_hash = await executors.run_io(pdf_reader.save_temp_pdf, file)
+        run = partial(pipelines.run_visual, pdf_path, file_hash, model_name)
+        if as_job:
+            job = await _submit_job("visual", file.filename, pdf_path, run)
+            pdf_path = None
+            return job
+        payload = await run()
+        return {"filename": file.filename, **payload}
+
+    except pdf_reader.PDFTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if pdf_path:
+            pdf_reader.remove_temp_pdf(pdf_path)
+
+@router.post("/analyze/full",
+             summary='Полный анализ',
+             description='Структурный, контентный и визуальный анализ за одну загрузку: PDF разбирается один раз, '
+                         'разделы считаются параллельно, у каждого раздела своё время и статус')
+async def analyze_full(
+    file : UploadFile = File(..., description='Загрузите презентацию в формате PDF'),
+    llm_model_id: int = Query(1, description='ID LLM-модели'),
+    vlm_model_id: int = Query(1, description='ID VLM-модели'),
+    use_rag: bool = Query(False, description='Использование RAG-системы'),
+    user_context: str = Query(None, max_length=255, description='Контекст для RAG (промт)'),
+    first_slide: bool = Query(True, description='Включение первого слайда в анализ'),
+    last_slide: bool = Query(True, description='Включение последнего слайда в анализ'),
+    max_tokens: int = Query(2000, gt=300, le=2000, description='Максимальное количество токенов для одного ответа'),
+    temperature: float = Query(0.0, ge=0.0, lt=1.0, description='Параметр степени случайности/креативности ответа'),
+    as_job: bool = Query(False, description='Поставить анализ в очередь и сразу вернуть ID задачи'),
+    llm_models = Depends(get_all_llm_models),
+    vlm_models = Depends(get_all_vlm_models)
+) -> dict:
+    _check_pdf(file)
+    llm_model_name = _find_model_name(llm_models, llm_model_id)
+    vlm_model_name = _find_model_name(vlm_models, vlm_model_id)
+
+    pdf_path = None
+    try:
+        pdf_path, file_hash = await executors.run_io(pdf_reader.save_temp_pdf, file)
+        run = partial(
+            pipelines.run_full,
+            pdf_path, file_hash, llm_model_name, vlm_model_name, use_rag, user_context,
+            first_slide, last_slide, max_tokens, temperature
+        )
+        if as_job:
+            job = await _submit_job("full", file.filename, pdf_path, run)
+            pdf_path = None
+            return job
+        payload = await run()
+        return {"filename": file.filename, **payload}
+
+    except pdf_reader.PDFTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Full analysis failed: {e}")
+    finally:
+        if pdf_path:
+            pdf_reader.remove_temp_pdf(pdf_path)
 
 @router.post("/add",
              summary='Дополнение RAG-системы контекстом',
-             description='Добавление новых документов в коллекцию RAG (Qdrant)')
+             description='Добавление новых документов в коллекцию RAG')
 def add_documents_to_rag(data: AddDocumentsRequest) -> dict:
     try:
         if not rag_analyzer.initialized:
             rag_analyzer.initialize()
 
-        rag_analyzer.add_documents(
+        counts = rag_analyzer.add_documents(
             docs=data.documents,
             ids=data.ids
         )
 
         return {
             "status": "success",
-            "added": len(data.documents)
+            "added": counts["added"],
+            "skipped": counts["skipped"]
         }
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _spool(chunks: AsyncIterator[bytes]) -> IO[bytes]:
+    # тело копится во временном файле (в памяти только первый мегабайт), чтобы его можно было
+    # читать построчно уже после того, как обработчик вернул StreamingResponse;
+    # как и у PDF, размер ограничен (MAX_INGEST_BYTES), чтобы клиент не мог заполнить диск
+    max_bytes = get_max_ingest_bytes()
+    spool = tempfile.SpooledTemporaryFile(max_size=pdf_reader.UPLOAD_CHUNK_SIZE)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                    detail=f"Тело запроса превышает допустимый размер {max_bytes} байт")
+            await executors.run_io(spool.write, chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+async def _upload_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(pdf_reader.UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+def _ingest_response(source: IO[bytes]) -> StreamingResponse:
+    async def events():
+        counts = {"received": 0, "invalid": 0}
+        queue: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def on_batch(progress: dict):
+            loop.call_soon_threadsafe(queue.put_nowait, {"event": "progress", **counts, **progress})
+
+        try:
+            if not rag_analyzer.initialized:
+                await executors.run_io(rag_analyzer.initialize)
+            task = asyncio.ensure_future(
+                executors.run_io(rag_analyzer.ingest, iter_ndjson_documents(source, counts), on_batch=on_batch)
+            )
+            task.add_done_callback(lambda _: queue.put_nowait(None))
+            while (event := await queue.get()) is not None:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            result = task.result()
+            yield json.dumps({"event": "done", "status": "success", **counts, **result}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e), **counts}, ensure_ascii=False) + "\n"
+        finally:
+            source.close()
+
+    # если клиент отключится до начала итерации, finally генератора не выполнится — закроет фоновая задача
+    return StreamingResponse(events(), media_type="application/x-ndjson", background=BackgroundTask(source.close))
+
+@router.post("/add/stream",
+             summary='Потоковая загрузка документов в RAG (NDJSON)',
+             description='Тело запроса — NDJSON, по документу на строку: {"text": ..., "id": ...} или JSON-строка. '
+                         'Документы загружаются батчами по RAG_BATCH_SIZE; в ответ идут NDJSON-события '
+                         'progress после каждого батча и итоговое done со счётчиками')
+async def add_documents_stream(request: Request) -> StreamingResponse:
+    return _ingest_response(await _spool(request.stream()))
+
+@router.post("/add/file",
+             summary='Загрузка документов в RAG из файла',
+             description='То же, что /add/stream, но NDJSON-файл передаётся как multipart-вложение')
+async def add_documents_file(
+    file: UploadFile = File(..., description='NDJSON-файл с документами')
+) -> StreamingResponse:
+    # UploadFile закрывается, когда обработчик вернёт StreamingResponse, поэтому копируем его заранее
+    return _ingest_response(await _spool(_upload_chunks(file)))
@@ -6,6 +6,50 @@ load_dotenv()
 HUGGINGFACE_HUB_TOKEN = os.getenv('HUGGINGFACE_HUB_TOKEN')
 QDRANT_URL = os.getenv('QDRANT_URL')
 QDRANT_API_KEY = os.getenv('QDRANT_API_KEY')
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+IO_POOL_SIZE = int(os.getenv('IO_POOL_SIZE', 16))
+CPU_POOL_SIZE = int(os.getenv('CPU_POOL_SIZE', os.cpu_count() or 1))
+INFERENCE_MAX_CONNECTIONS_PER_MODEL = int(os.getenv('INFERENCE_MAX_CONNECTIONS_PER_MODEL', 8))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 256))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 24 * 60 * 60))
+RESULT_CACHE_DB = os.getenv('RESULT_CACHE_DB')
+RESULT_CACHE_DB_MAX_BYTES = int(os.getenv('RESULT_CACHE_DB_MAX_BYTES', 512 * 1024 * 1024))
+SLIDE_CACHE_MAX_ENTRIES = int(os.getenv('SLIDE_CACHE_MAX_ENTRIES', 4096))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+RAG_BATCH_SIZE = int(os.getenv('RAG_BATCH_SIZE', 256))
+MAX_INGEST_BYTES = int(os.getenv('MAX_INGEST_BYTES', 512 * 1024 * 1024))
+EMBED_BATCH_MAX_SIZE = int(os.getenv('EMBED_BATCH_MAX_SIZE', 32))
+EMBED_BATCH_WAIT_MS = float(os.getenv('EMBED_BATCH_WAIT_MS', 5))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv('EMBED_CACHE_MAX_ENTRIES', 20000))
+EMBED_CACHE_DIR = os.getenv('EMBED_CACHE_DIR')
+EMBED_CACHE_DTYPE = os.getenv('EMBED_CACHE_DTYPE', 'float16')
+EMBED_CACHE_SHARD_SIZE = int(os.getenv('EMBED_CACHE_SHARD_SIZE', 4096))
+RAG_QUERY_MODE = os.getenv('RAG_QUERY_MODE', 'hybrid').lower()
+RAG_RERANK = os.getenv('RAG_RERANK', 'false').lower() in ('1', 'true', 'yes')
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', 20))
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', 32))
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv('RERANK_CACHE_MAX_ENTRIES', 1024))
+VECTOR_STORE = os.getenv('VECTOR_STORE', 'auto').lower()
+VECTOR_STORE_DIR = os.getenv('VECTOR_STORE_DIR', 'data/vectors')
+VECTOR_STORE_HNSW_THRESHOLD = int(os.getenv('VECTOR_STORE_HNSW_THRESHOLD', 20000))
+EMBEDDER_PRELOAD = os.getenv('EMBEDDER_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_STORE = os.getenv('JOB_STORE', 'memory')
+JOB_DB = os.getenv('JOB_DB', 'data/jobs.sqlite3')
+JOB_TTL = int(os.getenv('JOB_TTL', 24 * 60 * 60))
+VLM_MAX_CONCURRENCY = int(os.getenv('VLM_MAX_CONCURRENCY', 4))
+VLM_CAPTION_TIMEOUT = float(os.getenv('VLM_CAPTION_TIMEOUT', 60))
+VLM_IMAGE_FORMAT = os.getenv('VLM_IMAGE_FORMAT', 'jpeg').lower()
+VLM_IMAGE_QUALITY = int(os.getenv('VLM_IMAGE_QUALITY', 85))
+VLM_IMAGE_MAX_DIM = int(os.getenv('VLM_IMAGE_MAX_DIM', 1024))
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 2))
+ENCODED_IMAGE_CACHE_MAX_BYTES = int(os.getenv('ENCODED_IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+DENSITY_MAX_DIM = int(os.getenv('DENSITY_MAX_DIM', 1024))
+DENSITY_GRID = int(os.getenv('DENSITY_GRID', 0))
+RENDER_DPI = int(os.getenv('RENDER_DPI', 150))
+RENDER_MAX_DIM = int(os.getenv('RENDER_MAX_DIM', 2000))
 
 llm_models_list = [{'id' : 1, 'model_name' : 'IlyaGusev/saiga_llama3_8b', 'dev_level' : 'hard'},
                {'id' : 2, 'model_name' : 'distilgpt2', 'dev_level' : 'light'}]
@@ -14,6 +58,11 @@ vlm_models_list = [{'id' : 1, 'model_name' : 'Salesforce/blip2-flan-t5-xl', 'dev
                    {'id' : 2, 'model_name' : 'microsoft/Florence-2-large', 'dev_level' : 'medium'},
                    {'id' : 3, 'model_name' : 'Qwen/Qwen2-VL-7B-Instruct', 'dev_level' : 'medium'}]
 
+# Родное входное разрешение VLM (большая сторона): крупнее слать бессмысленно, модель всё равно уменьшит
+vlm_input_sizes = {'Salesforce/blip2-flan-t5-xl': 224,
+                   'microsoft/Florence-2-large': 768,
+                   'Qwen/Qwen2-VL-7B-Instruct': 1024}
+
 
 def get_hf_token():
     return HUGGINGFACE_HUB_TOKEN
@@ -24,6 +73,112 @@ def get_qdrant_url():
 def get_qdrant_api_key():
     return QDRANT_API_KEY
 
+def get_llm_max_concurrency():
+    return LLM_MAX_CONCURRENCY
+
+def get_io_pool_size():
+    return IO_POOL_SIZE
+
+def get_cpu_pool_size():
+    return CPU_POOL_SIZE
+
+def get_inference_max_connections_per_model():
+    return INFERENCE_MAX_CONNECTIONS_PER_MODEL
+
+def get_result_cache_settings():
+    return {
+        'max_entries': RESULT_CACHE_MAX_ENTRIES,
+        'max_bytes': RESULT_CACHE_MAX_BYTES,
+        'ttl': RESULT_CACHE_TTL,
+        'db_path': RESULT_CACHE_DB,
+        'db_max_bytes': RESULT_CACHE_DB_MAX_BYTES,
+    }
+
+def get_slide_cache_max_entries():
+    return SLIDE_CACHE_MAX_ENTRIES
+
+def get_max_upload_bytes():
+    return MAX_UPLOAD_BYTES
+
+def get_rag_batch_size():
+    return RAG_BATCH_SIZE
+
+def get_max_ingest_bytes():
+    return MAX_INGEST_BYTES
+
+def get_rag_query_mode():
+    return RAG_QUERY_MODE
+
+def get_rerank_settings():
+    return {
+        'enabled': RAG_RERANK,
+        'model': RERANK_MODEL,
+        'candidates': RERANK_CANDIDATES,
+        'batch_size': RERANK_BATCH_SIZE,
+        'cache_max_entries': RERANK_CACHE_MAX_ENTRIES,
+    }
+
+def get_embed_batch_settings():
+    return {
+        'max_batch_size': EMBED_BATCH_MAX_SIZE,
+        'max_wait_ms': EMBED_BATCH_WAIT_MS,
+    }
+
+def get_embed_cache_settings():
+    return {
+        'max_entries': EMBED_CACHE_MAX_ENTRIES,
+        'directory': EMBED_CACHE_DIR,
+        'dtype': EMBED_CACHE_DTYPE,
+        'shard_size': EMBED_CACHE_SHARD_SIZE,
+    }
+
+def get_vector_store_settings():
+    return {
+        'backend': VECTOR_STORE,
+        'directory': VECTOR_STORE_DIR,
+        'hnsw_threshold': VECTOR_STORE_HNSW_THRESHOLD,
+    }
+
+def get_embedder_preload():
+    return EMBEDDER_PRELOAD
+
+def get_job_settings():
+    return {
+        'workers': JOB_WORKERS,
+        'store': JOB_STORE,
+        'db_path': JOB_DB,
+        'ttl': JOB_TTL,
+    }
+
+def get_vlm_caption_settings():
+    return {
+        'max_concurrency': VLM_MAX_CONCURRENCY,
+        'timeout': VLM_CAPTION_TIMEOUT,
+        'phash_max_distance': PHASH_MAX_DISTANCE,
+    }
+
+def get_vlm_image_settings(model_name: str):
+    return {
+        'format': VLM_IMAGE_FORMAT,
+        'quality': VLM_IMAGE_QUALITY,
+        'max_dim': min(vlm_input_sizes.get(model_name, VLM_IMAGE_MAX_DIM), VLM_IMAGE_MAX_DIM),
+    }
+
+def get_encoded_image_cache_max_bytes():
+    return ENCODED_IMAGE_CACHE_MAX_BYTES
+
+def get_density_settings():
+    return {
+        'max_dim': DENSITY_MAX_DIM,
+        'grid': DENSITY_GRID,
+    }
+
+def get_render_dpi():
+    return RENDER_DPI
+
+def get_render_max_dim():
+    return RENDER_MAX_DIM
+
 def get_llm_models_list():
     return llm_models_list
 
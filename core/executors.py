@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from core.config import get_cpu_pool_size, get_io_pool_size
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict):
+    """
+    Выполняется внутри пула. Возвращает момент фактического старта задачи,
+    чтобы вызывающая сторона могла посчитать время ожидания в очереди.
+    Функция модульного уровня — её можно передавать в процессный пул.
+    """
+    started_at = time.time()
+    return started_at, func(*args, **kwargs)
+
+
+class _PoolStats:
+    def __init__(self, size: int):
+        self.size = size
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def on_submit(self):
+        with self._lock:
+            self.submitted += 1
+            self.active += 1
+
+    def on_done(self, wait: float, run: float, failed: bool):
+        with self._lock:
+            self.active -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.total_wait += wait
+            self.total_run += run
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "size": self.size,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "active": self.active,
+                "queued": max(0, self.active - self.size),
+                "avg_wait_ms": round(self.total_wait / finished * 1000, 2) if finished else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "avg_run_ms": round(self.total_run / finished * 1000, 2) if finished else 0.0,
+            }
+
+
+class ExecutorManager:
+    """
+    Управляемые пулы для блокирующих стадий обработки запросов:
+    - io: пул потоков для сетевых вызовов, работы с файлами, PyMuPDF, Qdrant, HF;
+    - cpu: пул процессов для тяжёлых вычислений (рендеринг слайдов).
+    Размеры задаются через IO_POOL_SIZE / CPU_POOL_SIZE.
+    """
+
+    def __init__(self):
+        self.io_pool: Optional[ThreadPoolExecutor] = None
+        self.cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._stats: Dict[str, _PoolStats] = {}
+
+    def start(self):
+        if self.io_pool is None:
+            size = get_io_pool_size()
+            self.io_pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="io")
+            self._stats["io"] = _PoolStats(size)
+        if self.cpu_pool is None:
+            size = get_cpu_pool_size()
+            # spawn — не форкаем процесс с уже запущенными потоками и загруженными моделями
+            self.cpu_pool = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+            self._stats["cpu"] = _PoolStats(size)
+
+    def shutdown(self):
+        if self.io_pool is not None:
+            self.io_pool.shutdown(wait=False, cancel_futures=True)
+            self.io_pool = None
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown(wait=False, cancel_futures=True)
+            self.cpu_pool = None
+
+    async def run_io(self, func: Callable, *args, **kwargs) -> Any:
+        self.start()
+        return await self._run("io", self.io_pool, func, args, kwargs)
+
+    async def run_cpu(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        func и аргументы должны сериализоваться pickle (функции модульного уровня).
+        """
+        self.start()
+        return await self._run("cpu", self.cpu_pool, func, args, kwargs)
+
+    async def _run(self, name: str, pool: Executor, func: Callable, args: tuple, kwargs: dict) -> Any:
+        stats = self._stats[name]
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+        stats.on_submit()
+        try:
+            started_at, result = await loop.run_in_executor(pool, _timed_call, func, args, kwargs)
+        except BaseException:
+            stats.on_done(0.0, time.time() - submitted_at, failed=True)
+            raise
+        stats.on_done(max(0.0, started_at - submitted_at), time.time() - started_at, failed=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: s.snapshot() for name, s in self._stats.items()}
+
+
+executors = ExecutorManager()
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import requests
+from huggingface_hub import InferenceClient, configure_http_backend
+from requests.adapters import HTTPAdapter
+
+from core.config import get_hf_token, get_inference_max_connections_per_model
+from core.executors import executors
+
+
+class InferenceClientRegistry:
+    """
+    Общий на процесс реестр InferenceClient по имени модели.
+    Клиенты создаются один раз при старте приложения и переиспользуются всеми запросами:
+    HTTP-сессии huggingface_hub работают с keep-alive пулом соединений, а число
+    одновременных запросов к каждой модели ограничено INFERENCE_MAX_CONNECTIONS_PER_MODEL.
+    """
+
+    def __init__(self):
+        self.hf_token: Optional[str] = get_hf_token()
+        self.max_connections: int = get_inference_max_connections_per_model()
+        self._clients: Dict[str, InferenceClient] = {}
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.initialized: bool = False
+
+    def initialize(self, model_names: Iterable[str]):
+        if not self.initialized:
+            # huggingface_hub держит по одной сессии на поток — потоки io-пула живут долго,
+            # поэтому соединения и TLS-сессии переиспользуются между запросами
+            configure_http_backend(backend_factory=self._session_factory)
+            self.initialized = True
+        for name in model_names:
+            self.get(name)
+        print(f"[InferenceClientRegistry] clients ready: {', '.join(self._clients)}")
+
+    def _session_factory(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, len(self._clients)), pool_maxsize=self.max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, model_name: str) -> InferenceClient:
+        client = self._clients.get(model_name)
+        if client is not None:
+            return client
+        with self._lock:
+            if model_name not in self._clients:
+                self._clients[model_name] = InferenceClient(model=model_name, token=self.hf_token)
+                self._limits[model_name] = asyncio.Semaphore(self.max_connections)
+                self._in_flight[model_name] = 0
+            return self._clients[model_name]
+
+    async def run(self, model_name: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Выполняет блокирующий вызов клиента (chat_completion, image_to_text, ...) в io-пуле,
+        соблюдая лимит одновременных соединений для модели.
+        """
+        self.get(model_name)
+        async with self._limits[model_name]:
+            self._in_flight[model_name] += 1
+            try:
+                return await executors.run_io(func, *args, **kwargs)
+            finally:
+                self._in_flight[model_name] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {"limit": self.max_connections, "in_flight": in_flight}
+            for name, in_flight in self._in_flight.items()
+        }
+
+
+inference_clients = InferenceClientRegistry()
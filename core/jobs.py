@@ -0,0 +1,250 @@
+import asyncio
+import copy
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.config import get_job_settings
+from core.executors import executors
+
+
+Progress = Callable[[str, str], Awaitable[None]]
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore(ABC):
+    """
+    Хранилище состояний фоновых задач. Задача — JSON-совместимый словарь с ключом "id".
+    """
+
+    @abstractmethod
+    def save(self, job: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def prune(self, finished_before: float) -> None:
+        ...
+
+
+class InMemoryJobStore(JobStore):
+
+    def __init__(self):
+        self._jobs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = json.dumps(job, ensure_ascii=False)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            raw = self._jobs.get(job_id)
+        return json.loads(raw) if raw is not None else None
+
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = [json.loads(raw) for raw in self._jobs.values()]
+        return [job for job in jobs if job["status"] in ("queued", "running")]
+
+    def prune(self, finished_before: float) -> None:
+        with self._lock:
+            for job_id, raw in list(self._jobs.items()):
+                job = json.loads(raw)
+                if job.get("finished_at") and job["finished_at"] < finished_before:
+                    del self._jobs[job_id]
+
+
+class SqliteJobStore(JobStore):
+    """
+    Задачи в SQLite-файле: статусы и готовые отчёты переживают перезапуск сервера.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, data TEXT NOT NULL, finished_at REAL)"
+            )
+            self._db.commit()
+
+    def save(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, data, finished_at) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], json.dumps(job, ensure_ascii=False), job.get("finished_at")),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def prune(self, finished_before: float) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,))
+            self._db.commit()
+
+
+class JobManager:
+    """
+    Очередь фоновых анализов с ограниченным числом воркеров (JOB_WORKERS).
+    Клиент сразу получает ID задачи и опрашивает GET /api/jobs/{id}.
+    Хранилище выбирается через JOB_STORE: memory (по умолчанию) или sqlite (JOB_DB).
+    Каждая задача помечается процессом-владельцем (host, pid): при общем SQLite-файле
+    несколько воркеров не трогают живые задачи друг друга.
+    """
+
+    def __init__(self):
+        settings = get_job_settings()
+        self.workers: int = settings['workers']
+        self.ttl: int = settings['ttl']
+        self.store: JobStore = (
+            SqliteJobStore(settings['db_path']) if settings['store'] == 'sqlite' else InMemoryJobStore()
+        )
+        self.owner: Dict[str, Any] = {"host": socket.gethostname(), "pid": os.getpid()}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        # Задачи, оборванные перезапуском, продолжить нельзя: временные PDF уже удалены.
+        # Завершаем только задачи умерших процессов этого хоста — задачи соседних воркеров ещё выполняются
+        for job in await executors.run_io(self.store.list_unfinished):
+            if not self._orphaned(job):
+                continue
+            job.update(status="failed", error="Прервано перезапуском сервера", finished_at=time.time())
+            await executors.run_io(self.store.save, job)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, run: Callable[[Progress], Awaitable[Dict[str, Any]]],
+                     cleanup: Optional[Callable[[], None]] = None, meta: Optional[Dict[str, Any]] = None) -> str:
+        await self.start()
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "owner": self.owner,
+            "status": "queued",
+            "meta": meta or {},
+            "stages": {},
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        if self.ttl > 0:
+            await executors.run_io(self.store.prune, now - self.ttl)
+        await self._persist(job)
+        await self._queue.put((job, run, cleanup))
+        return job["id"]
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await executors.run_io(self.store.get, job_id)
+        if job is not None:
+            # host и pid воркера — внутренняя отметка, клиенту не отдаём
+            job.pop("owner", None)
+        if job is not None and job["status"] == "queued":
+            job["queue_size"] = self._queue.qsize() if self._queue else 0
+        return job
+
+    def _orphaned(self, job: Dict[str, Any]) -> bool:
+        owner = job.get("owner")
+        if not owner:
+            # задачи без владельца остались от версии без этой отметки
+            return True
+        if owner.get("host") != self.owner["host"]:
+            # жив ли процесс на другом хосте, отсюда не проверить
+            return False
+        return owner.get("pid") != self.owner["pid"] and not _process_alive(owner["pid"])
+
+    async def _worker(self):
+        while True:
+            job, run, cleanup = await self._queue.get()
+            try:
+                await self._execute(job, run)
+            except Exception as e:
+                # сбой записи в хранилище (или несериализуемый результат) не должен убивать воркер
+                print(f"[JobManager] job {job['id']} crashed: {e}")
+                await self._mark_failed(job, e)
+            finally:
+                if cleanup:
+                    try:
+                        cleanup()
+                    except Exception as e:
+                        print(f"[JobManager] cleanup for job {job['id']} failed: {e}")
+                self._queue.task_done()
+
+    async def _mark_failed(self, job: Dict[str, Any], error: Exception):
+        job.update(status="failed", result=None, error=str(error), finished_at=time.time())
+        try:
+            await self._persist(job)
+        except Exception as e:
+            print(f"[JobManager] could not persist failure of job {job['id']}: {e}")
+
+    async def _execute(self, job: Dict[str, Any], run: Callable[[Progress], Awaitable[Dict[str, Any]]]):
+        async def progress(stage: str, state: str):
+            job["stages"][stage] = state
+            await self._persist(job)
+
+        job.update(status="running", started_at=time.time())
+        await self._persist(job)
+        try:
+            job["result"] = await run(progress)
+            job["status"] = "done"
+        except Exception as e:
+            print(f"[JobManager] job {job['id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["finished_at"] = time.time()
+        await self._persist(job)
+
+    async def _persist(self, job: Dict[str, Any]):
+        # снимок делается в event loop: параллельные стадии продолжают менять job, пока идёт запись
+        await executors.run_io(self.store.save, copy.deepcopy(job))
+
+
+job_manager = JobManager()
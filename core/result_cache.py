@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from core.config import get_result_cache_settings
+
+
+class ResultCache:
+    """
+    Двухуровневый кэш JSON-результатов анализа:
+    - in-memory LRU с ограничением по числу записей и суммарному размеру;
+    - необязательный SQLite-файл (RESULT_CACHE_DB), переживающий перезапуски.
+    Оба уровня вытесняют записи по TTL и по размеру (первыми уходят давно не читанные).
+    Значения хранятся сериализованными, поэтому вызывающий код всегда получает свою копию.
+    """
+
+    def __init__(self, name: str, **overrides):
+        settings = {**get_result_cache_settings(), **overrides}
+        self.name = name
+        self.max_entries: int = settings['max_entries']
+        self.max_bytes: int = settings['max_bytes']
+        self.ttl: int = settings['ttl']
+        self.db_path: Optional[str] = settings['db_path']
+        self.db_max_bytes: int = settings['db_max_bytes']
+
+        self._memory: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._open_db()
+
+    @staticmethod
+    def make_key(*parts, **params) -> str:
+        payload = json.dumps([parts, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ---- публичный интерфейс -------------------------------------------------
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created_at, raw, _ = item
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(raw)
+                self._drop_memory(key)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, created_at FROM {self.name} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    raw, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._put_memory(key, created_at, raw)
+                        self.hits += 1
+                        return json.loads(raw)
+                    self._db.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, raw)
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, size, created_at, accessed_at) "
+                    f"VALUES (?, ?, ?, ?, ?)",
+                    (key, raw, len(raw.encode("utf-8")), now, now),
+                )
+                self._evict_db(now)
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
+
+    # ---- память --------------------------------------------------------------
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _put_memory(self, key: str, created_at: float, raw: str):
+        self._drop_memory(key)
+        size = len(raw.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._memory[key] = (created_at, raw, size)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+
+    def _drop_memory(self, key: str):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= item[2]
+
+    # ---- SQLite ----------------------------------------------------------------
+    def _open_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_accessed ON {self.name} (accessed_at)")
+        self._db.commit()
+
+    def _evict_db(self, now: float):
+        if self.ttl > 0:
+            self._db.execute(f"DELETE FROM {self.name} WHERE created_at < ?", (now - self.ttl,))
+        total = self._db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.name}").fetchone()[0]
+        if total <= self.db_max_bytes:
+            return
+        excess = total - self.db_max_bytes
+        victims = []
+        for key, size in self._db.execute(f"SELECT key, size FROM {self.name} ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany(f"DELETE FROM {self.name} WHERE key = ?", victims)
+
+
+result_cache = ResultCache("analysis_results")
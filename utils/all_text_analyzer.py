@@ -1,10 +1,19 @@
 # utils/all_text_analyzer.py
 
+import asyncio
 import json
 import re
-from typing import Dict, Any, List, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from huggingface_hub import InferenceClient
-from core.config import get_hf_token
+from core.config import get_llm_max_concurrency, get_slide_cache_max_entries
+from core.executors import executors
+from core.inference_clients import inference_clients
+from core.result_cache import ResultCache
+
+
+# Результаты отдельных блоков слайдов: при повторной загрузке исправленной презентации
+# в модель уходят только блоки, текст которых изменился
+block_cache = ResultCache("structure_blocks", max_entries=get_slide_cache_max_entries())
 
 
 class AllTextAnalyzer:
@@ -14,11 +23,11 @@ class AllTextAnalyzer:
     """
 
     def __init__(self, model_name, max_tokens, temperature):
-        self.hf_token: Optional[str] = get_hf_token()
         self.client: Optional[InferenceClient] = None
         self.model_name: str = model_name
         self.models_initialized: bool = False
         self.slides_per_block: int = 5
+        self.max_concurrency: int = get_llm_max_concurrency()
         self.max_tokens = max_tokens
         self.temperature = temperature
 
@@ -26,17 +35,18 @@ class AllTextAnalyzer:
         if self.models_initialized:
             return
         try:
-            self.client = InferenceClient(token=self.hf_token)
+            self.client = inference_clients.get(self.model_name)
             self.models_initialized = True
             print(f"[AllTextAnalyzer] InferenceClient ready (model {self.model_name})")
         except Exception as e:
             print(f"[AllTextAnalyzer] init error: {e}")
             self.models_initialized = False
 
-    def analyze_full_text(self, full_text: str) -> Dict[str, Any]:
+    async def analyze_full_text(self, full_text: str) -> Dict[str, Any]:
         """
         Анализ всей презентации.
-        Разбиваем текст на блоки, генерируем JSON для каждого блока, потом объединяем.
+        Разбиваем текст на блоки, генерируем JSON для каждого блока (блоки уходят в модель
+        параллельно, не более max_concurrency запросов одновременно), потом объединяем.
         После объединения пытаемся автоматом сопоставить найденные weaknesses/recommendations
         с номерами слайдов (если модель не указала их напрямую).
         """
@@ -47,18 +57,55 @@ class AllTextAnalyzer:
         slide_texts = re.split(r'(--- SLIDE \d+ ---)', clean_text)
         blocks = self._make_blocks(slide_texts, self.slides_per_block)
 
-        # Генерируем JSON для каждого блока
-        block_results = []
-        for block_text in blocks:
-            prompt = self._build_prompt_for_structural_analysis(block_text)
-            raw = self._call_chat_model(prompt, max_tokens=self.max_tokens, temperature=self.temperature)
-            parsed = self._try_parse_json(raw)
-            if parsed:
-                block_results.append(parsed)
-            else:
-                # fallback на блок
-                block_results.append(self._fallback_summary(clean_text))
+        # Генерируем JSON для каждого блока; gather сохраняет порядок блоков
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        block_results = await asyncio.gather(
+            *(self._analyze_block(block_text, clean_text, semaphore) for block_text in blocks)
+        )
+        return self._combine_block_results(block_results, clean_text)
+
+    async def iter_block_results(self, full_text: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Потоковый вариант analyze_full_text. Отдаёт ("block", {...}) для каждого блока в порядке
+        готовности — с номерами слайдов блока и уже сопоставленными weaknesses/recommendations,
+        последним отдаёт ("summary", отчёт), совпадающий с результатом analyze_full_text.
+        """
+        clean_text = self._normalize_full_text(full_text)
+        if not self.models_initialized or not self.client:
+            yield "summary", self._fallback_summary(clean_text)
+            return
 
+        slide_texts = re.split(r'(--- SLIDE \d+ ---)', clean_text)
+        blocks = self._make_blocks(slide_texts, self.slides_per_block)
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def analyze_indexed(idx: int, block_text: str):
+            return idx, await self._analyze_block(block_text, clean_text, semaphore)
+
+        tasks = [asyncio.ensure_future(analyze_indexed(i, b)) for i, b in enumerate(blocks)]
+        block_results: List[Optional[Dict[str, Any]]] = [None] * len(blocks)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                idx, parsed = await next_done
+                block_results[idx] = parsed
+                try:
+                    block_report = self._attach_slide_numbers_if_missing(parsed, blocks[idx])
+                except Exception as e:
+                    print(f"[AllTextAnalyzer] slide mapping warning: {e}")
+                    block_report = parsed
+                yield "block", {
+                    "block": idx + 1,
+                    "total_blocks": len(blocks),
+                    "slides": [int(n) for n in re.findall(r'--- SLIDE (\d+) ---', blocks[idx])],
+                    "result": block_report,
+                }
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        yield "summary", self._combine_block_results(block_results, clean_text)
+
+    def _combine_block_results(self, block_results: List[Dict[str, Any]], clean_text: str) -> Dict[str, Any]:
         # Объединяем результаты всех блоков
         combined = self._merge_block_results(block_results)
 
@@ -96,6 +143,22 @@ class AllTextAnalyzer:
             blocks.append("\n\n".join(current_block))
         return blocks
 
+    async def _analyze_block(self, block_text: str, clean_text: str, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        prompt = self._build_prompt_for_structural_analysis(block_text)
+        cache_key = block_cache.make_key(self.model_name, self.max_tokens, self.temperature, prompt)
+        cached = await executors.run_io(block_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        async with semaphore:
+            raw = await self._call_chat_model(prompt, max_tokens=self.max_tokens, temperature=self.temperature)
+        parsed = self._try_parse_json(raw)
+        if parsed:
+            await executors.run_io(block_cache.set, cache_key, parsed)
+            return parsed
+        # fallback на блок: помечен degraded, в общий отчёт его заглушки не попадают
+        return self._fallback_summary(clean_text)
+
     def _build_prompt_for_structural_analysis(self, text: str) -> str:
         instruction = (
             "Ты — эксперт по презентациям. Проанализируй структуру презентации (только текст и заголовки). "
@@ -110,11 +173,13 @@ class AllTextAnalyzer:
         )
         return instruction + "\n\n" + text
 
-    def _call_chat_model(self, user_prompt: str, max_tokens: int = 2000, temperature: float = 0.0) -> str:
+    async def _call_chat_model(self, user_prompt: str, max_tokens: int = 2000, temperature: float = 0.0) -> str:
         if not self.client:
             return ""
         try:
-            response = self.client.chat_completion(
+            response = await inference_clients.run(
+                self.model_name,
+                self.client.chat_completion,
                 model=self.model_name,
                 messages=[{"role": "user", "content": user_prompt}],
                 max_tokens=max_tokens,
@@ -140,11 +205,19 @@ class AllTextAnalyzer:
 
     # ---- объединение результатов блоков ---------------------------------
     def _merge_block_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        combined = results[0] if results else {}
-        if len(results) == 1:
-            return combined
+        # блоки-заглушки (сбой модели) не сливаем: их weaknesses выдуманы; число таких блоков
+        # уходит в degraded_blocks, и отчёт с ними не кэшируется целиком
+        real = [r for r in results if not r.get("degraded")]
+        degraded_blocks = len(results) - len(real)
+        if not real:
+            return {**self._fallback_summary(""), "degraded_blocks": degraded_blocks}
 
-        for r in results[1:]:
+        # копия: результаты блоков лежат в block_cache и не должны меняться
+        combined = dict(real[0])
+        for key in ["strengths", "weaknesses", "recommendations"]:
+            combined[key] = list(combined.get(key, []))
+        combined["degraded_blocks"] = degraded_blocks
+        for r in real[1:]:
             for key in ["strengths", "weaknesses", "recommendations"]:
                 # инициализация ключей если надо
                 combined.setdefault(key, [])
@@ -329,7 +402,8 @@ class AllTextAnalyzer:
             "style": "общий",
             "audience_level": "общая",
             "overall_quality_score": 5,
-            "final_verdict": "Fallback"
+            "final_verdict": "Fallback",
+            "degraded": True
         }
 
     def _fallback_summary(self, text: str) -> Dict[str, Any]:
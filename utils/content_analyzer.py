@@ -2,7 +2,7 @@ import json
 import re
 from typing import Dict, Any, Optional
 from huggingface_hub import InferenceClient
-from core.config import get_hf_token
+from core.inference_clients import inference_clients
 
 
 class ContentAnalyzer:
@@ -13,7 +13,6 @@ class ContentAnalyzer:
     """
 
     def __init__(self, model_name, max_tokens, temperature):
-        self.hf_token: Optional[str] = get_hf_token()
         self.client: Optional[InferenceClient] = None
         self.model_name: str = model_name
         self.models_initialized: bool = False
@@ -24,14 +23,14 @@ class ContentAnalyzer:
         if self.models_initialized:
             return
         try:
-            self.client = InferenceClient(token=self.hf_token)
+            self.client = inference_clients.get(self.model_name)
             self.models_initialized = True
             print(f"[ContentAnalyzer] InferenceClient ready (model {self.model_name})")
         except Exception as e:
             print(f"[ContentAnalyzer] init error: {e}")
             self.models_initialized = False
 
-    def analyze_full_content(self, full_text: str) -> Dict[str, Any]:
+    async def analyze_full_content(self, full_text: str) -> Dict[str, Any]:
         """
         Анализ содержания всей презентации. Возвращает словарь с ключевыми полями:
         - main_topic
@@ -45,7 +44,7 @@ class ContentAnalyzer:
             return self._fallback_summary(clean_text)
 
         prompt = self._build_prompt_for_content_analysis(clean_text)
-        raw = self._call_chat_model(prompt, max_tokens=self.max_tokens, temperature=self.temperature)
+        raw = await self._call_chat_model(prompt, max_tokens=self.max_tokens, temperature=self.temperature)
 
         parsed = self._try_parse_json(raw)
         if parsed:
@@ -75,11 +74,13 @@ class ContentAnalyzer:
         )
         return instruction + "\n\n" + text
 
-    def _call_chat_model(self, prompt: str, max_tokens: int = 800, temperature: float = 0.0) -> str:
+    async def _call_chat_model(self, prompt: str, max_tokens: int = 800, temperature: float = 0.0) -> str:
         if not self.client:
             return ""
         try:
-            response = self.client.chat_completion(
+            response = await inference_clients.run(
+                self.model_name,
+                self.client.chat_completion,
                 model=self.model_name,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
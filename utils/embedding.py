@@ -1,14 +1,158 @@
-from typing import List
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from core.config import get_embed_batch_settings
+from utils.embedding_cache import embedding_cache
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-embedder = SentenceTransformer(MODEL_NAME)
+
+# Модель загружается лениво при первом обращении (или фоновым прогревом при EMBEDDER_PRELOAD=true):
+# воркеры, которые не используют RAG, не поднимают torch и не держат модель в памяти.
+_embedder = None
+_lock = threading.Lock()
+_state: Dict[str, Any] = {"status": "not_loaded", "load_seconds": None, "error": None}
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is not None:
+        return _embedder
+    with _lock:
+        if _embedder is None:
+            _state.update(status="loading", error=None)
+            started = time.perf_counter()
+            try:
+                from sentence_transformers import SentenceTransformer
+                _embedder = SentenceTransformer(MODEL_NAME)
+            except Exception as e:
+                _state.update(status="failed", error=str(e))
+                raise
+            _state.update(status="ready", load_seconds=round(time.perf_counter() - started, 3))
+            print(f"[embedding] {MODEL_NAME} loaded in {_state['load_seconds']}s")
+    return _embedder
+
+def warm_up():
+    try:
+        get_embedder()
+    except Exception as e:
+        print(f"[embedding] warm-up failed: {e}")
+
+def embedder_status() -> Dict[str, Any]:
+    return {"model": MODEL_NAME, **_state}
 
 def embed_text(text: str) -> List[float]:
-    vec = embedder.encode(text, normalize_embeddings=True)
-    return vec.tolist()
+    return embed_texts([text])[0]
 
 def embed_texts(texts: List[str]) -> List[List[float]]:
-    vectors = embedder.encode(texts, normalize_embeddings=True)
-    return vectors.tolist()
+    """
+    Эмбеддинги с кэшем по (модель, текст): модель кодирует только тексты, которых нет в кэше,
+    повторы внутри одного вызова кодируются один раз.
+    """
+    keys = [embedding_cache.make_key(MODEL_NAME, text) for text in texts]
+    vectors = embedding_cache.get_many(keys)
+
+    missing: Dict[str, str] = {}
+    for key, text, vec in zip(keys, texts, vectors):
+        if vec is None:
+            missing.setdefault(key, text)
+    if missing:
+        encoded = get_embedder().encode(list(missing.values()), normalize_embeddings=True)
+        fresh = dict(zip(missing, np.asarray(encoded, dtype=np.float32)))
+        embedding_cache.put_many(fresh)
+        vectors = [vec if vec is not None else fresh[key] for key, vec in zip(keys, vectors)]
+
+    return [vec.tolist() for vec in vectors]
+
+
+class EmbeddingBatcher:
+    """
+    Микробатчинг запросов на эмбеддинг между конкурентными запросами.
+    Тексты копятся в очереди до max_batch_size штук или max_wait_ms с момента первого,
+    затем кодируются одним вызовом модели; каждый вызывающий получает свой Future.
+    """
+
+    def __init__(self, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        settings = get_embed_batch_settings()
+        self.max_batch_size: int = max_batch_size or settings['max_batch_size']
+        self.max_wait: float = (max_wait_ms if max_wait_ms is not None else settings['max_wait_ms']) / 1000
+        self._queue: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.total_wait = 0.0
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def submit_many(self, texts: List[str]) -> List[Future]:
+        return [self.submit(text) for text in texts]
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        # все тексты встают в очередь сразу и делят батчи с запросами других обработчиков
+        return [future.result() for future in self.submit_many(texts)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "avg_wait_ms": round(self.total_wait / self.items * 1000, 2) if self.items else 0.0,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[Tuple[str, Future, float]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                vectors = embed_texts([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), vec in zip(batch, vectors):
+                future.set_result(vec)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.total_wait += sum(started - queued_at for _, _, queued_at in batch)
+
+
+query_batcher = EmbeddingBatcher()
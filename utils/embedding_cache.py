@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.config import get_embed_cache_settings
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов по ключу sha256(модель + текст).
+    - in-memory LRU на EMBED_CACHE_MAX_ENTRIES векторов;
+    - необязательное хранилище на диске (EMBED_CACHE_DIR): векторы копятся в буфере и сбрасываются
+      шардами .npy по shard_size строк в компактном dtype (float16 по умолчанию), читаются через mmap;
+      индекс ключ -> (шард, строка) лежит в SQLite рядом с шардами.
+    """
+
+    def __init__(self, **overrides):
+        settings = {**get_embed_cache_settings(), **overrides}
+        self.max_entries: int = settings['max_entries']
+        self.directory: Optional[str] = settings['directory']
+        self.dtype = np.dtype(settings['dtype'])
+        self.shard_size: int = settings['shard_size']
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, np.ndarray] = {}
+        self._shards: Dict[int, np.ndarray] = {}
+        self._index: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.directory:
+            self._open_index()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    # ---- публичный интерфейс -------------------------------------------------
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = [None] * len(keys)
+        with self._lock:
+            disk_lookup: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is None:
+                    vec = self._pending.get(key)
+                if vec is not None:
+                    self._put_memory(key, vec)
+                    found[i] = vec
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup and self._index is not None:
+                for key, vec in self._read_disk(list(disk_lookup)).items():
+                    self._put_memory(key, vec)
+                    for i in disk_lookup.pop(key):
+                        found[i] = vec
+                        self.disk_hits += 1
+
+            self.misses += sum(len(positions) for positions in disk_lookup.values())
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vec in vectors.items():
+                vec = np.asarray(vec, dtype=np.float32)
+                self._put_memory(key, vec)
+                if self._index is not None:
+                    self._pending[key] = vec
+            if self._index is not None and len(self._pending) >= self.shard_size:
+                self._flush_pending()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._index is not None and self._pending:
+                self._flush_pending()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            stats = {
+                "entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._index is not None,
+            }
+            if self._index is not None:
+                stats["disk_entries"] = self._index.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+                stats["pending"] = len(self._pending)
+            return stats
+
+    # ---- память --------------------------------------------------------------
+    def _put_memory(self, key: str, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # ---- диск ----------------------------------------------------------------
+    def _open_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), check_same_thread=False)
+        self._index.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, shard INTEGER NOT NULL, row INTEGER NOT NULL)"
+        )
+        # выданные номера шардов: каталог могут делить несколько процессов
+        self._index.execute("CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY)")
+        self._index.commit()
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard_{shard:05d}.npy")
+
+    def _shard(self, shard: int) -> np.ndarray:
+        if shard not in self._shards:
+            self._shards[shard] = np.load(self._shard_path(shard), mmap_mode="r")
+        return self._shards[shard]
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        result = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._index.execute(
+                f"SELECT key, shard, row FROM vectors WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, shard, row in rows:
+                result[key] = np.asarray(self._shard(shard)[row], dtype=np.float32)
+        return result
+
+    def _reserve_shard(self) -> int:
+        # BEGIN IMMEDIATE берёт блокировку записи до выбора номера, так что два процесса
+        # не получат один шард и не перезапишут файл друг друга
+        self._index.execute("BEGIN IMMEDIATE")
+        try:
+            shard = self._index.execute(
+                "SELECT MAX(COALESCE((SELECT MAX(id) FROM shards), -1), "
+                "COALESCE((SELECT MAX(shard) FROM vectors), -1)) + 1"
+            ).fetchone()[0]
+            self._index.execute("INSERT INTO shards (id) VALUES (?)", (shard,))
+        except BaseException:
+            self._index.rollback()
+            raise
+        self._index.commit()
+        return shard
+
+    def _flush_pending(self):
+        shard = self._reserve_shard()
+        keys = list(self._pending)
+        matrix = np.stack([self._pending[key] for key in keys]).astype(self.dtype)
+        path = self._shard_path(shard)
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, path)
+        self._index.executemany(
+            "INSERT OR REPLACE INTO vectors (key, shard, row) VALUES (?, ?, ?)",
+            [(key, shard, row) for row, key in enumerate(keys)],
+        )
+        self._index.commit()
+        self._pending.clear()
+
+
+embedding_cache = EmbeddingCache()
@@ -1,93 +1,287 @@
-
-import json
+import asyncio
 import io
+import json
 import re
-from typing import List, Dict, Any, Optional
-from PIL import Image
-from huggingface_hub import InferenceClient
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
 
+import numpy as np
+from huggingface_hub import InferenceClient
+from PIL import Image
 
-from core.config import get_hf_token
+from core.config import (get_density_settings, get_encoded_image_cache_max_bytes, get_slide_cache_max_entries,
+                         get_vlm_caption_settings, get_vlm_image_settings,)
+from core.executors import executors
+from core.inference_clients import inference_clients
+from core.result_cache import ResultCache
+from utils.pdf_reader import combine_slide_stats, density_stats, hamming_distance, image_fingerprint, perceptual_hash
+
+
+# Подписи слайдов с LRU по (модель, точный dHash, текст слайда): тот же слайд из другой презентации
+# или в другом разрешении повторно не отправляется в VLM. Один dHash не различает слайды шаблона
+# с разным текстом, поэтому без текстового слоя ключ — sha256 пикселей
+caption_cache = ResultCache("slide_captions", max_entries=get_slide_cache_max_entries())
+
+# Порог text_coverage для text_heavy по источнику метрик: у вёрстки это доля площади текстовых блоков,
+# у растра — доля тёмных пикселей * 1.8, на том же слайде растровая оценка в разы меньше
+TEXT_HEAVY_COVERAGE = {"layout": 0.45, "raster": 0.35}
+# image_heavy: у вёрстки — доля площади под изображениями, у растра (скан — это одна картинка) — мало текста
+IMAGE_HEAVY_AREA = 0.4
+RASTER_IMAGE_HEAVY_COVERAGE = 0.08
+
+
+def encode_for_vlm(img: Image.Image, fmt: str, quality: int, max_dim: int) -> bytes:
+    """
+    Готовит слайд для VLM: уменьшает до родного входа модели (max_dim по большей стороне)
+    и кодирует в JPEG/WebP с заданным качеством (или PNG без потерь).
+    """
+    if max(img.size) > max_dim:
+        scale = max_dim / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    buf = io.BytesIO()
+    if fmt == "png":
+        img.save(buf, format="PNG")
+    else:
+        img.convert("RGB").save(buf, format=fmt.upper(), quality=quality)
+    return buf.getvalue()
+
+
+class EncodedImageCache:
+    """
+    LRU уже закодированных слайдов по (отпечаток, параметры кодирования) с лимитом по байтам:
+    повторная подпись того же слайда (ретрай, другой анализ) не кодирует его заново.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+encoded_image_cache = EncodedImageCache(get_encoded_image_cache_max_bytes())
 
 
 class ImageAnalyzer:
 
     def __init__(self, model_name):
-        self.hf_token: Optional[str] = get_hf_token()
         self.vlm_client: Optional[InferenceClient] = None
         self.llm_client: Optional[InferenceClient] = None
 
         self.caption_model = model_name
         self.reasoning_model = "IlyaGusev/saiga_llama3_8b"
 
+        settings = get_vlm_caption_settings()
+        self.max_concurrency: int = settings['max_concurrency']
+        self.caption_timeout: float = settings['timeout']
+        self.phash_max_distance: int = settings['phash_max_distance']
+        self.density_grid: int = get_density_settings()['grid']
+        self.image_settings = get_vlm_image_settings(model_name)
+
         self.models_initialized = False
 
     async def initialize_models(self):
         if self.models_initialized:
             return
         try:
-            self.vlm_client = InferenceClient(model=self.caption_model, token=self.hf_token)
-            self.llm_client = InferenceClient(token=self.hf_token)
+            self.vlm_client = inference_clients.get(self.caption_model)
+            self.llm_client = inference_clients.get(self.reasoning_model)
             self.models_initialized = True
             print(f"[ImageAnalyzer] InferenceClient ready (model {self.caption_model})")
         except Exception as e:
             print(f"[ImageAnalyzer] init error: {e}")
             self.models_initialized = False
 
-    async def analyze_visual_presentation(self, slide_images: List[Image.Image]) -> Dict[str, Any]:
+    async def analyze_visual_presentation(self, slide_images: AsyncIterable[Image.Image],
+                                          slide_stats: Optional[List[Dict[str, Any]]] = None,
+                                          slide_texts: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        slide_stats — заранее посчитанные метрики слайдов (pdf_reader.slide_visual_stats: вёрстка из PDF,
+        для сканов — растровая плотность); если их нет, плотность оценивается по отрендеренному изображению.
+        slide_texts — текстовый слой слайдов: по нему подтверждаются дубликаты с близким dHash.
+        """
 
         if not self.models_initialized:
             return self._fallback()
 
-        slide_results = []
+        # Слайды подписываются параллельно, но в работе не больше VLM_MAX_CONCURRENCY штук:
+        # следующий слайд не рендерится, пока не освободится место, так что память ограничена
+        limit = asyncio.Semaphore(self.max_concurrency)
+        # уже встреченные слайды презентации: дубликаты ждут одну общую подпись
+        deck: List[Tuple[int, str, Optional[str], int, asyncio.Future]] = []
+        tasks: List[asyncio.Task] = []
+        try:
+            idx = 0
+            async for img in slide_images:
+                idx += 1
+                await limit.acquire()
+                text = slide_texts[idx - 1] if slide_texts is not None and idx <= len(slide_texts) else None
+                tasks.append(asyncio.create_task(self._analyze_slide(idx, img, text, limit, deck, slide_stats)))
+            # gather сохраняет порядок задач, поэтому slide_results идут по номерам слайдов
+            analyzed = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        slide_results = [info for info, _ in analyzed]
+
+        prompt = self._build_global_prompt(slide_results)
+        raw = await self._call_llm(prompt)
+        parsed = self._try_parse_json(raw)
 
-        for idx, img in enumerate(slide_images, start=1):
+        result = parsed if parsed else self._fallback()
+        # слайды без подписи (ошибка или таймаут VLM): отчёт по ним неполный и не кэшируется
+        result["degraded_captions"] = sum(1 for info in slide_results if not info["caption"])
+        # метрики подготовки изображений — для диагностики, в промпт они не попадают
+        result["slide_metrics"] = [metrics for _, metrics in analyzed]
+        return result
+
+    async def _analyze_slide(self, idx: int, img: Image.Image, text: Optional[str], limit: asyncio.Semaphore,
+                             deck: List[Tuple[int, str, Optional[str], int, asyncio.Future]],
+                             slide_stats: Optional[List[Dict[str, Any]]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        try:
             info = {"slide_number": idx}
+            metrics = {"slide_number": idx, "caption_source": "vlm",
+                       "encode_ms": None, "payload_bytes": None, "encoded_cached": False}
 
             try:
-                info["caption"] = self._caption(img)
-            except:
+                info["caption"] = await asyncio.wait_for(self._caption(idx, img, text, metrics, deck), self.caption_timeout)
+            except asyncio.TimeoutError:
+                print(f"[ImageAnalyzer] caption timeout on slide {idx}")
+                info["caption"] = ""
+            except Exception:
                 info["caption"] = ""
 
-            stats = self._estimate_text_density(img)
-            info.update(stats)
-
-            if info["text_coverage"] > 0.35:
-                info["slide_type"] = "text_heavy"
-            elif info["text_coverage"] < 0.08:
-                info["slide_type"] = "image_heavy"
+            if slide_stats is not None and idx <= len(slide_stats):
+                stats = slide_stats[idx - 1]
             else:
-                info["slide_type"] = "balanced"
-
-            slide_results.append(info)
-
-        prompt = self._build_global_prompt(slide_results)
-        raw = self._call_llm(prompt)
-        parsed = self._try_parse_json(raw)
-
-        if parsed:
-            return parsed
-
-        return self._fallback()
-
-    def _caption(self, img: Image.Image) -> str:
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
+                stats = await executors.run_io(self._estimate_text_density, img)
+            info.update(stats)
+            info["slide_type"] = self._slide_type(stats)
+
+            return info, metrics
+        finally:
+            limit.release()
+
+    async def _caption(self, idx: int, img: Image.Image, text: Optional[str], metrics: Dict[str, Any],
+                       deck: List[Tuple[int, str, Optional[str], int, asyncio.Future]]) -> str:
+        phash = await executors.run_io(perceptual_hash, img)
+        fingerprint = await executors.run_io(image_fingerprint, img)
+        metrics["phash"] = format(phash, "064x")
+        # пустой текстовый слой (скан, слайд-картинка) ничего не подтверждает
+        text_key = " ".join(text.split()) if text else None
+        text_key = text_key or None
+        # близкий dHash — только кандидат: слайды шаблона с разными заголовками дают расстояние 0,
+        # поэтому подпись общая лишь при том же тексте или тех же пикселях.
+        # Проверка и регистрация идут без await между ними, так что гонки между слайдами нет
+        for other_hash, other_fingerprint, other_text, other_idx, shared in deck:
+            same_content = fingerprint == other_fingerprint or (text_key is not None and text_key == other_text)
+            if same_content and hamming_distance(phash, other_hash) <= self.phash_max_distance:
+                metrics.update(caption_source="duplicate", duplicate_of=other_idx)
+                return await asyncio.shield(shared)
+        shared = asyncio.get_running_loop().create_future()
+        deck.append((phash, fingerprint, text_key, idx, shared))
+
+        if text_key is not None:
+            cache_key = caption_cache.make_key(self.caption_model, "dhash", metrics["phash"], text_key)
+        else:
+            cache_key = caption_cache.make_key(self.caption_model, "sha256", fingerprint)
+        caption = ""
         try:
-            resp = self.vlm_client.image_to_text(buf)
-            return resp.get("generated_text", "").strip()
+            caption = await self._caption_image(img, fingerprint, cache_key, metrics)
+            return caption
+        finally:
+            # при ошибке или таймауте дубликаты получают пустую подпись, как и сам слайд
+            if not shared.done():
+                shared.set_result(caption)
+
+    async def _caption_image(self, img: Image.Image, fingerprint: str, cache_key: str,
+                             metrics: Dict[str, Any]) -> str:
+        cached = await executors.run_io(caption_cache.get, cache_key)
+        if cached is not None:
+            metrics["caption_source"] = "cache"
+            return cached
+
+        payload = await self._encoded(img, fingerprint, metrics)
+        try:
+            resp = await inference_clients.run(self.caption_model, self.vlm_client.image_to_text, payload)
+            caption = resp.get("generated_text", "").strip()
         except:
             return ""
+        if caption:
+            await executors.run_io(caption_cache.set, cache_key, caption)
+        return caption
+
+    async def _encoded(self, img: Image.Image, fingerprint: str, metrics: Dict[str, Any]) -> bytes:
+        settings = self.image_settings
+        key = f"{fingerprint}:{settings['format']}:{settings['quality']}:{settings['max_dim']}"
+        payload = encoded_image_cache.get(key)
+        if payload is not None:
+            metrics.update(encode_ms=0.0, payload_bytes=len(payload), encoded_cached=True)
+            return payload
+
+        started = time.perf_counter()
+        # PIL отпускает GIL при ресайзе и кодировании, поэтому пул потоков даёт реальный параллелизм
+        payload = await executors.run_io(
+            encode_for_vlm, img, settings['format'], settings['quality'], settings['max_dim']
+        )
+        metrics.update(encode_ms=round((time.perf_counter() - started) * 1000, 1), payload_bytes=len(payload))
+        encoded_image_cache.set(key, payload)
+        return payload
+
+    def _estimate_text_density(self, img: Image.Image) -> Dict[str, Any]:
+        # запасной путь, когда пакетная оценка по PDF недоступна: считаем по уже отрендеренному слайду
+        raster = density_stats([np.asarray(img.convert("L"))], self.density_grid)[0]
+        return combine_slide_stats(None, raster, self.density_grid)
 
-    def _estimate_text_density(self, img: Image.Image) -> Dict[str, float]:
-        gray = img.convert("L")
-        hist = gray.histogram()
-        dark = sum(hist[:70])
-        total = sum(hist)
-        density = dark / total if total else 0
-        coverage = min(1.0, density * 1.8)
-        return {"text_density": round(density, 4), "text_coverage": round(coverage, 4)}
+    @staticmethod
+    def _slide_type(stats: Dict[str, Any]) -> str:
+        source = stats["source"]
+        if stats["text_coverage"] > TEXT_HEAVY_COVERAGE[source]:
+            return "text_heavy"
+        if source == "layout":
+            image_heavy = (stats["image_coverage"] or 0.0) >= IMAGE_HEAVY_AREA
+        else:
+            image_heavy = stats["text_coverage"] < RASTER_IMAGE_HEAVY_COVERAGE
+        return "image_heavy" if image_heavy else "balanced"
 
 
 
@@ -114,9 +308,11 @@ class ImageAnalyzer:
         )
 
 
-    def _call_llm(self, prompt: str) -> str:
+    async def _call_llm(self, prompt: str) -> str:
         try:
-            resp = self.llm_client.chat_completion(
+            resp = await inference_clients.run(
+                self.reasoning_model,
+                self.llm_client.chat_completion,
                 model=self.reasoning_model,
                 messages=[
                     {"role": "system", "content": "Ты — эксперт по визуальному анализу презентаций. Всегда отвечай на русском языке. Формат ответа — строго JSON."},
@@ -153,6 +349,7 @@ class ImageAnalyzer:
             "recommendations": ["Попробуйте позже"],
             "design_style": "неопределён",
             "visual_quality_score": 5,
-            "final_verdict": "Fallback"
+            "final_verdict": "Fallback",
+            "degraded": True
         }
 
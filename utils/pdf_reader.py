@@ -1,16 +1,58 @@
+import asyncio
+import hashlib
 import tempfile
-from typing import List, Dict
+from collections import deque
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 
+import numpy as np
 import pymupdf
-from pdf2image import convert_from_path
+from PIL import Image
 import os
 
-# POPPLER_PATH = r"D:\poppler\Library\bin"
+from core.config import (get_cpu_pool_size, get_density_settings, get_max_upload_bytes, get_render_dpi,
+                         get_render_max_dim)
+from core.executors import executors
 
-def save_temp_pdf(upload_file):
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-        tmp.write(upload_file.file.read())
-        return tmp.name
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PHASH_SIZE = 16
+# порог "тёмного" пикселя для оценки плотности текста (яркость 0..255)
+DARK_THRESHOLD = 70
+# кегль (pt), мельче которого текст на слайде считается трудночитаемым
+SMALL_FONT_SIZE = 14
+
+
+class PDFTooLargeError(Exception):
+    pass
+
+
+def save_temp_pdf(upload_file, max_bytes: Optional[int] = None) -> Tuple[str, str]:
+    """
+    Потоково пишет загруженный файл на диск блоками по UPLOAD_CHUNK_SIZE,
+    попутно считая sha256. Возвращает (путь к временному файлу, sha256).
+    При превышении max_bytes (MAX_UPLOAD_BYTES) или любой ошибке временный файл удаляется.
+    """
+    max_bytes = max_bytes or get_max_upload_bytes()
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+    try:
+        with tmp:
+            for chunk in iter(lambda: upload_file.file.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PDFTooLargeError(f"Файл превышает допустимый размер {max_bytes} байт")
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        remove_temp_pdf(tmp.name)
+        raise
+    return tmp.name, digest.hexdigest()
+
+def remove_temp_pdf(pdf_path: str):
+    try:
+        os.unlink(pdf_path)
+    except FileNotFoundError:
+        pass
 
 def extract_text(pdf_path):
     text = ""
@@ -23,17 +65,196 @@ def extract_text(pdf_path):
         print(f"Error extracting text: {e}")
     return text
 
-def pdf_to_images(pdf_path):
+def page_count(pdf_path: str) -> int:
+    with pymupdf.open(pdf_path) as doc:
+        return len(doc)
+
+def render_page(pdf_path: str, page_index: int, dpi: int, max_dim: int) -> Image.Image:
+    """
+    Рендерит одну страницу через PyMuPDF. Выполняется в процессном пуле,
+    поэтому документ открывается заново в каждом вызове.
+    Масштаб ограничен max_dim по большей стороне, чтобы крупные страницы не раздували память.
+    """
+    with pymupdf.open(pdf_path) as doc:
+        page = doc[page_index]
+        zoom = dpi / 72
+        longest = max(page.rect.width, page.rect.height) * zoom
+        if max_dim and longest > max_dim:
+            zoom *= max_dim / longest
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+async def iter_slide_images(pdf_path: str, dpi: Optional[int] = None,
+                            max_dim: Optional[int] = None) -> AsyncIterator[Image.Image]:
+    """
+    Лениво отдаёт отрендеренные слайды по порядку. Страницы распределяются по процессному пулу,
+    одновременно в работе не больше окна из нескольких страниц — память не растёт с размером
+    презентации, а первый слайд доступен сразу после своего рендера.
+    """
+    dpi = dpi or get_render_dpi()
+    max_dim = max_dim if max_dim is not None else get_render_max_dim()
+    total = await executors.run_io(page_count, pdf_path)
+    window = get_cpu_pool_size() + 1
+
+    pending = deque()
+    next_page = 0
     try:
-        # Указываем явный путь тулзы poppler, без docker-контейнера
-        # images = convert_from_path(pdf_path, poppler_path=POPPLER_PATH)
+        while next_page < total or pending:
+            while next_page < total and len(pending) < window:
+                pending.append(asyncio.ensure_future(
+                    executors.run_cpu(render_page, pdf_path, next_page, dpi, max_dim)
+                ))
+                next_page += 1
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
 
-        #При использовании docker-контейнера, тулза автоматически подключается.
-        images = convert_from_path(pdf_path)
-        return images
-    except Exception as e:
-        print(f"Error converting PDF to images: {e}")
-        return []
+def density_stats(buffers: List[np.ndarray], grid: int = 0) -> List[Dict]:
+    """
+    Плотность текста по серым буферам слайдов: доля тёмных пикселей и покрытие (density * 1.8, не больше 1).
+    Буферы одного размера складываются в один массив и считаются одной векторной операцией;
+    при grid > 0 добавляется карта покрытия grid x grid по блокам слайда.
+    """
+    results: List[Optional[Dict]] = [None] * len(buffers)
+    by_shape: Dict[Tuple[int, int], List[int]] = {}
+    for i, buf in enumerate(buffers):
+        by_shape.setdefault(buf.shape, []).append(i)
+
+    for (height, width), indices in by_shape.items():
+        dark = np.stack([buffers[i] for i in indices]) < DARK_THRESHOLD
+        densities = dark.mean(axis=(1, 2)) if height and width else np.zeros(len(indices))
+        maps = None
+        if grid and height >= grid and width >= grid:
+            bh, bw = height // grid, width // grid
+            blocks = dark[:, :bh * grid, :bw * grid].reshape(len(indices), grid, bh, grid, bw)
+            maps = np.minimum(1.0, blocks.mean(axis=(2, 4)) * 1.8).round(3)
+        for n, i in enumerate(indices):
+            density = float(densities[n])
+            stats = {"text_density": round(density, 4), "text_coverage": round(min(1.0, density * 1.8), 4)}
+            if maps is not None:
+                stats["coverage_map"] = maps[n].tolist()
+            results[i] = stats
+    return results
+
+def slide_text_density(pdf_path: str, max_dim: Optional[int] = None, grid: Optional[int] = None,
+                       pages: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Плотность текста всех слайдов без полноразмерного рендера: каждая страница рендерится
+    сразу в оттенках серого с большей стороной max_dim (DENSITY_MAX_DIM), буфер pixmap
+    читается numpy без копирования (samples_mv), затем все слайды считаются пакетно.
+    pages — индексы страниц (по умолчанию все). Выполняется в процессном пуле.
+    """
+    settings = get_density_settings()
+    max_dim = max_dim or settings['max_dim']
+    grid = settings['grid'] if grid is None else grid
+    with pymupdf.open(pdf_path) as doc:
+        pixmaps, buffers = [], []
+        for page_index in (range(len(doc)) if pages is None else pages):
+            page = doc[page_index]
+            zoom = max_dim / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csGRAY, alpha=False)
+            # pixmap держим живым, пока numpy смотрит в его память
+            pixmaps.append(pix)
+            buffers.append(
+                np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+            )
+        return density_stats(buffers, grid)
+
+def _rect_area(rect: pymupdf.Rect, clip: pymupdf.Rect) -> float:
+    rect = pymupdf.Rect(rect) & clip
+    return 0.0 if rect.is_empty else rect.width * rect.height
+
+def page_layout_metrics(page: pymupdf.Page) -> Dict:
+    """
+    Метрики вёрстки страницы по векторным данным PDF, без растеризации:
+    доли площади под текстовыми блоками и изображениями, число блоков и распределение кеглей
+    (взвешенное по числу символов). scanned=True — на странице нет текстового слоя,
+    но есть крупное изображение: такие слайды оцениваются по растру.
+    """
+    clip = page.rect
+    page_area = clip.width * clip.height or 1.0
+
+    text_area = 0.0
+    text_blocks = 0
+    sizes: List[float] = []
+    weights: List[int] = []
+    # TEXTFLAGS_TEXT: без картинок внутри dict, иначе PyMuPDF копирует их байты
+    for block in page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        chars = 0
+        for line in block["lines"]:
+            for span in line["spans"]:
+                n = len(span["text"].strip())
+                if n:
+                    sizes.append(span["size"])
+                    weights.append(n)
+                    chars += n
+        if chars:
+            text_blocks += 1
+            text_area += _rect_area(block["bbox"], clip)
+
+    image_area = 0.0
+    images = page.get_images(full=True)
+    for xref in {img[0] for img in images}:
+        for rect in page.get_image_rects(xref):
+            image_area += _rect_area(rect, clip)
+
+    metrics = {
+        "text_coverage": round(min(1.0, text_area / page_area), 4),
+        "image_coverage": round(min(1.0, image_area / page_area), 4),
+        "text_blocks": text_blocks,
+        "image_count": len(images),
+        "font_size": None,
+        "scanned": not sizes and image_area / page_area >= 0.5,
+    }
+    if sizes:
+        order = np.argsort(sizes)
+        sorted_sizes = np.asarray(sizes)[order]
+        cumulative = np.cumsum(np.asarray(weights)[order])
+        median = sorted_sizes[np.searchsorted(cumulative, cumulative[-1] / 2)]
+        small = np.searchsorted(sorted_sizes, SMALL_FONT_SIZE)
+        metrics["font_size"] = {
+            "min": round(float(sorted_sizes[0]), 1),
+            "median": round(float(median), 1),
+            "max": round(float(sorted_sizes[-1]), 1),
+            "small_text_ratio": round(float(cumulative[small - 1] / cumulative[-1]) if small else 0.0, 4),
+        }
+    return metrics
+
+def slide_layout_metrics(pdf_path: str) -> List[Dict]:
+    with pymupdf.open(pdf_path) as doc:
+        return [page_layout_metrics(page) for page in doc]
+
+def combine_slide_stats(layout: Optional[Dict], raster: Optional[Dict], grid: int = 0) -> Dict:
+    """
+    Статистика слайда в единой схеме: одинаковые ключи у всех слайдов, None — не измерено.
+    text_coverage берётся из растра, если он есть (source="raster"), иначе из вёрстки (source="layout");
+    шкалы у источников разные, поэтому сравнивать их можно только с учётом source.
+    """
+    stats = {"text_density": None, "text_coverage": 0.0, "image_coverage": None,
+             "text_blocks": None, "image_count": None, "font_size": None}
+    if grid:
+        stats["coverage_map"] = None
+    if layout is not None:
+        stats.update((key, value) for key, value in layout.items() if key != "scanned")
+    if raster is not None:
+        stats.update(raster)
+    stats["source"] = "raster" if raster is not None else "layout"
+    return stats
+
+def slide_visual_stats(pdf_path: str) -> List[Dict]:
+    """
+    Статистика слайдов для визуального анализа: для слайдов с текстовым слоем — точные
+    метрики вёрстки, для сканов — плотность текста по серому растру (slide_text_density).
+    Выполняется в процессном пуле.
+    """
+    layouts = slide_layout_metrics(pdf_path)
+    scanned = [i for i, metrics in enumerate(layouts) if metrics["scanned"]]
+    rasters = dict(zip(scanned, slide_text_density(pdf_path, pages=scanned))) if scanned else {}
+    grid = get_density_settings()['grid']
+    return [combine_slide_stats(layout, rasters.get(i), grid) for i, layout in enumerate(layouts)]
 
 def extract_text_by_slides(pdf_path: str) -> List[Dict]:
     slides_text = []
@@ -50,4 +271,28 @@ def extract_text_by_slides(pdf_path: str) -> List[Dict]:
         doc.close()
     except Exception as e:
         print(f'Error extracting text by slides : {e}')
-    return slides_text
\ No newline at end of file
+    return slides_text
+
+def image_fingerprint(img) -> str:
+    """
+    Отпечаток отрендеренного слайда: sha256 от пикселей, размера и режима изображения.
+    """
+    digest = hashlib.sha256(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def perceptual_hash(img, size: int = PHASH_SIZE) -> int:
+    """
+    dHash слайда: изображение сжимается до (size + 1) x size в оттенках серого,
+    каждый бит — ярче ли пиксель своего соседа справа. Похожие слайды дают хэши
+    с малым расстоянием Хэмминга. Мелкий текст при таком сжатии почти не виден: слайды одного шаблона,
+    различающиеся заголовком или строкой, могут дать расстояние 0, поэтому хэш используется
+    только вместе с текстом слайда или отпечатком пикселей.
+    """
+    gray = img.resize((size + 1, size), Image.BILINEAR).convert("L")
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
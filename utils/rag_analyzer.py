@@ -1,71 +1,286 @@
 
 
-from typing import List, Dict, Any
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, VectorParams, Distance
-from core.config import get_qdrant_url, get_qdrant_api_key
-from utils.embedding import embed_text
+import hashlib
+import json
+import os
+import unicodedata
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+from core.config import get_rag_batch_size, get_rag_query_mode, get_rerank_settings, get_vector_store_settings
+from utils.embedding import embed_texts, query_batcher
+from utils.reranker import rerank_many
+from utils.sparse_index import BM25Index
+from utils.vector_store import VectorStore, create_vector_store
+
+
+EMBEDDING_DIM = 384
+# MiniLM обрезает вход на 256 токенах; для русского текста это примерно 150 слов
+CHUNK_MAX_WORDS = 150
+RRF_K = 60
+# в гибридном режиме каждый из поисков (dense и BM25) отдаёт на слияние не меньше стольких кандидатов
+HYBRID_CANDIDATES = 20
+QUERY_MODES = ("dense", "sparse", "hybrid")
+
+
+def chunk_text(text: str, max_words: int = CHUNK_MAX_WORDS) -> List[str]:
+    """
+    Делит текст на куски не длиннее max_words слов, чтобы эмбеддер не отбрасывал хвост.
+    """
+    words = text.split()
+    return [" ".join(words[start:start + max_words]) for start in range(0, len(words), max_words)]
+
+
+def fuse_rrf(result_lists: List[List[Dict[str, Any]]], top_k: int, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Reciprocal rank fusion: документ получает сумму 1 / (k + ранг) по всем спискам,
+    повторы схлопываются по тексту. Возвращает top_k документов с итоговым score.
+    """
+    fused: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, start=1):
+            fused[hit["text"]] = fused.get(hit["text"], 0.0) + 1.0 / (k + rank)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [{"text": text, "score": score} for text, score in ranked]
+
+
+def document_id(text: str) -> str:
+    """
+    Детерминированный id документа: UUID из sha256 нормализованного текста
+    (NFKC, схлопнутые пробелы). Qdrant принимает UUID-строки как id точек.
+    """
+    normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+    return str(uuid.UUID(bytes=hashlib.sha256(normalized.encode("utf-8")).digest()[:16]))
+
+
+def iter_ndjson_documents(lines: IO[bytes], counts: Dict[str, int]) -> Iterator[Tuple[str, Optional[Hashable]]]:
+    """
+    Построчно разбирает NDJSON с документами: {"text": ..., "id": ...} или просто JSON-строка.
+    Пустые строки пропускаются, битые и документы без текста считаются в counts["invalid"].
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            counts["invalid"] += 1
+            continue
+        if isinstance(item, str):
+            item = {"text": item}
+        text = item.get("text") if isinstance(item, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            counts["invalid"] += 1
+            continue
+        counts["received"] += 1
+        yield text, item.get("id")
 
 
 class RAGAnalyzer:
     """
-    RAG Analyzer с использованием Qdrant для семантического поиска по контексту.
+    RAG Analyzer для семантического поиска по контексту.
+    Векторное хранилище выбирается через VECTOR_STORE: Qdrant или локальный индекс (numpy / hnsw).
+    Рядом с векторами ведётся лексический индекс BM25; режим поиска задаёт RAG_QUERY_MODE.
     """
 
     def __init__(self, collection_name: str = "presentation_rules"):
         self.collection_name = collection_name
-        self.client: QdrantClient | None = None
+        self.store: VectorStore | None = None
+        self.sparse_index: BM25Index | None = None
         self.initialized: bool = False
 
     def initialize(self):
-        api_url = get_qdrant_url()
-        api_token = get_qdrant_api_key()
+        self.store = create_vector_store(self.collection_name, EMBEDDING_DIM)
+        directory = get_vector_store_settings()['directory']
+        sparse_path = os.path.join(directory, self.collection_name, "bm25.jsonl") if directory else None
+        self.sparse_index = BM25Index(sparse_path)
+        print(f"[RAGAnalyzer] vector store: {type(self.store).__name__}, bm25 docs: {len(self.sparse_index)}")
+        self.initialized = True
 
-        if not api_url or not api_token:
-            raise ValueError("Не заданы QDRANT_API_URL или QDRANT_API_TOKEN")
+    def add_documents(self, docs: List[str], ids: List[int] | None = None,
+                      batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Документы эмбеддятся батчами по batch_size (RAG_BATCH_SIZE) и загружаются в хранилище теми же батчами.
+        """
+        return self.ingest(zip(docs, ids if ids else [None] * len(docs)), batch_size)
 
-        self.client = QdrantClient(url=api_url, api_key=api_token)
+    def ingest(self, items: Iterable[Tuple[str, Optional[Hashable]]], batch_size: Optional[int] = None,
+               on_batch: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+        """
+        Загрузка потока пар (текст, id): из итератора берётся не больше batch_size документов за раз,
+        так что память не зависит от размера корпуса. Upsert батча выполняется в отдельном потоке,
+        пока эмбеддится следующий; после каждого подтверждённого upsert батч попадает в BM25 и вызывается
+        on_batch со счётчиками.
+        Документы без id получают id из хэша содержимого; уже сохранённые пропускаются без эмбеддинга.
+        """
+        if not self.initialized or self.store is None:
+            raise RuntimeError("RAGAnalyzer не инициализирован")
 
-        if not self.client.collection_exists(self.collection_name):
-            vector_params = VectorParams(size=384, distance=Distance.COSINE)
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=vector_params
-            )
+        batch_size = batch_size or get_rag_batch_size()
+        counts = {"added": 0, "skipped": 0, "batches": 0}
+        iterator = iter(items)
+        pending: Optional[Future] = None
+        pending_docs: Tuple[List[str], List[Hashable]] = ([], [])
 
-        self.initialized = True
+        def confirm():
+            pending.result()
+            # в BM25 — только после подтверждённого upsert, иначе sparse-поиск вернёт точки, которых нет в хранилище
+            self.sparse_index.add(*pending_docs)
+            counts["added"] += len(pending_docs[0])
+            counts["batches"] += 1
+            if on_batch is not None:
+                on_batch(dict(counts))
 
-    def add_documents(self, docs: List[str], ids: List[int] | None = None):
-        if not self.initialized or self.client is None:
-            raise RuntimeError("RAGAnalyzer не инициализирован")
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-upsert") as uploader:
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    break
+                texts, batch_ids, stored = self._new_documents(batch)
+                counts["skipped"] += len(batch) - len(texts)
+                if stored:
+                    # уже сохранённые в хранилище документы могут отсутствовать в BM25 (например, новый хост
+                    # при общем Qdrant) — индекс сам пропускает то, что уже знает
+                    self.sparse_index.add([text for text, _ in stored], [point_id for _, point_id in stored])
+                if not texts:
+                    if on_batch is not None:
+                        on_batch(dict(counts))
+                    continue
+                vectors = embed_texts(texts)
+                payloads = [{"text": text} for text in texts]
+                # не больше одного upsert в полёте: ждём предыдущий, прежде чем отправить следующий
+                if pending is not None:
+                    confirm()
+                pending = uploader.submit(self.store.upsert, batch_ids, vectors, payloads)
+                pending_docs = (texts, batch_ids)
+            if pending is not None:
+                confirm()
+        self.store.flush()
+        return counts
 
-        points: List[PointStruct] = []
-        for idx, doc in enumerate(docs):
-            vec = embed_text(doc)
-            point_id = ids[idx] if ids else None
-            points.append(PointStruct(id=point_id, vector=vec, payload={"text": doc}))
+    def _new_documents(self, batch: List[Tuple[str, Optional[Hashable]]]
+                       ) -> Tuple[List[str], List[Hashable], List[Tuple[str, Hashable]]]:
+        """
+        Назначает id из хэша содержимого документам без id и отбрасывает повторы внутри батча
+        и документы, которые уже есть в хранилище (проверка одним запросом на батч).
+        Документы с явным id всегда перезаписываются.
+        Возвращает тексты и id новых документов и пары (текст, id) пропущенных как уже сохранённые.
+        """
+        texts, ids, hashed, seen = [], [], [], set()
+        for text, point_id in batch:
+            if point_id is None:
+                point_id = document_id(text)
+                hashed.append(point_id)
+            if point_id in seen:
+                continue
+            seen.add(point_id)
+            texts.append(text)
+            ids.append(point_id)
 
-        self.client.upsert(collection_name=self.collection_name, points=points)
+        existing = self.store.existing_ids(hashed) if hashed else set()
+        if not existing:
+            return texts, ids, []
+        kept, stored = [], []
+        for text, point_id in zip(texts, ids):
+            (stored if point_id in existing else kept).append((text, point_id))
+        return [text for text, _ in kept], [point_id for _, point_id in kept], stored
 
-    def query(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    def query(self, query_text: str, top_k: int = 3, mode: Optional[str] = None,
+              rerank: Optional[bool] = None) -> List[Dict[str, Any]]:
         """
-        Семантический поиск по коллекции.
-        Возвращает top_k наиболее релевантных документов.
+        Поиск по коллекции в режиме mode (dense, sparse или hybrid; по умолчанию RAG_QUERY_MODE).
+        При rerank (по умолчанию RAG_RERANK) первый этап отбирает RERANK_CANDIDATES кандидатов,
+        а кросс-энкодер выбирает из них top_k. Возвращает top_k наиболее релевантных документов.
         """
-        if not self.initialized or not self.client:
+        mode = self._check_mode(mode)
+        rerank, first_k = self._first_stage(rerank, top_k)
+        dense = []
+        if mode != "sparse":
+            # одиночные запросы из параллельных обработчиков склеиваются в общий батч
+            vec = query_batcher.embed(query_text)
+            dense = self._to_docs(self.store.search(vec, self._pool_size(mode, first_k)))
+        candidates = self._combine(mode, dense, query_text, first_k)
+        return rerank_many([query_text], [candidates], top_k)[0] if rerank else candidates
+
+    def query_many(self, query_texts: List[str], top_k: int = 3, mode: Optional[str] = None,
+                   rerank: Optional[bool] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск сразу по нескольким запросам: эмбеддинги идут через общий микробатчер,
+        поиск в хранилище — одним пакетным запросом, переранжирование — одним вызовом кросс-энкодера.
+        Возвращает по списку top_k на каждый запрос.
+        """
+        mode = self._check_mode(mode)
+        if not query_texts:
+            return []
+        rerank, first_k = self._first_stage(rerank, top_k)
+        candidates = self._candidates(query_texts, mode, first_k)
+        return rerank_many(query_texts, candidates, top_k) if rerank else candidates
+
+    def query_chunks(self, chunks: List[str], top_k: int = 3, mode: Optional[str] = None,
+                     rerank: Optional[bool] = None) -> List[Dict[str, Any]]:
+        """
+        Поиск по документу, разбитому на куски: кандидаты первого этапа всех кусков сливаются через RRF
+        в один список из RERANK_CANDIDATES документов без повторов. При rerank кросс-энкодер оценивает
+        только этот список — каждый документ в паре с куском, где он стоял выше всего, — так что число пар
+        не растёт с числом слайдов. Возвращает общий top_k.
+        """
+        mode = self._check_mode(mode)
+        if not chunks:
+            return []
+        rerank, first_k = self._first_stage(rerank, top_k)
+        per_chunk = self._candidates(chunks, mode, first_k)
+        fused = fuse_rrf(per_chunk, first_k)
+        if not rerank:
+            return fused[:top_k]
+
+        best_chunk: Dict[str, Tuple[int, str]] = {}
+        for chunk, docs in zip(chunks, per_chunk):
+            for rank, doc in enumerate(docs):
+                if doc["text"] not in best_chunk or rank < best_chunk[doc["text"]][0]:
+                    best_chunk[doc["text"]] = (rank, chunk)
+        reranked = rerank_many([best_chunk[doc["text"]][1] for doc in fused], [[doc] for doc in fused], 1)
+        return sorted((docs[0] for docs in reranked if docs), key=lambda doc: doc["score"], reverse=True)[:top_k]
+
+    def _candidates(self, query_texts: List[str], mode: str, first_k: int) -> List[List[Dict[str, Any]]]:
+        dense_lists = [[] for _ in query_texts]
+        if mode != "sparse":
+            vectors = query_batcher.embed_many(query_texts)
+            dense_lists = [
+                self._to_docs(hits) for hits in self.store.search_batch(vectors, self._pool_size(mode, first_k))
+            ]
+        return [self._combine(mode, dense, text, first_k) for dense, text in zip(dense_lists, query_texts)]
+
+    @staticmethod
+    def _first_stage(rerank: Optional[bool], top_k: int) -> Tuple[bool, int]:
+        settings = get_rerank_settings()
+        rerank = settings['enabled'] if rerank is None else rerank
+        return rerank, max(top_k, settings['candidates']) if rerank else top_k
+
+    def _check_mode(self, mode: Optional[str]) -> str:
+        if not self.initialized or self.store is None:
             raise RuntimeError("RAGAnalyzer не инициализирован")
+        mode = mode or get_rag_query_mode()
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Неизвестный режим поиска RAG: {mode}")
+        return mode
 
-        vec = embed_text(query_text)
+    @staticmethod
+    def _pool_size(mode: str, top_k: int) -> int:
+        return max(top_k, HYBRID_CANDIDATES) if mode == "hybrid" else top_k
 
-        search_result = self.client.query_points(
-            collection_name=self.collection_name,
-            query=vec,
-            limit=top_k
-        )
+    def _combine(self, mode: str, dense: List[Dict[str, Any]], query_text: str, top_k: int) -> List[Dict[str, Any]]:
+        if mode == "dense":
+            return dense
+        sparse = self.sparse_index.search(query_text, self._pool_size(mode, top_k))
+        if mode == "sparse":
+            return sparse
+        # шкалы косинуса и BM25 несравнимы, поэтому сливаем по рангам
+        return fuse_rrf([dense, sparse], top_k)
 
-        return [
-            {"text": point.payload.get("text", ""), "score": point.score}
-            for point in search_result.points
-        ]
+    @staticmethod
+    def _to_docs(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [{"text": hit["payload"].get("text", ""), "score": hit["score"]} for hit in hits]
 
 rag_analyzer = RAGAnalyzer()
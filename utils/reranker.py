@@ -0,0 +1,99 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+from core.config import get_rerank_settings
+from core.result_cache import ResultCache
+
+
+_settings = get_rerank_settings()
+MODEL_NAME = _settings['model']
+
+# отранжированные списки по (модель, запрос, набор кандидатов, top_k)
+rerank_cache = ResultCache("reranked", max_entries=_settings['cache_max_entries'])
+
+# Кросс-энкодер, как и эмбеддер, грузится лениво: без RAG_RERANK он не поднимается вовсе
+_reranker = None
+_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_state: Dict[str, Any] = {"status": "not_loaded", "load_seconds": None, "error": None}
+_latency = {"calls": 0, "queries": 0, "cache_hits": 0, "pairs": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+
+def get_reranker():
+    global _reranker
+    if _reranker is not None:
+        return _reranker
+    with _lock:
+        if _reranker is None:
+            _state.update(status="loading", error=None)
+            started = time.perf_counter()
+            try:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(MODEL_NAME, device="cpu")
+            except Exception as e:
+                _state.update(status="failed", error=str(e))
+                raise
+            _state.update(status="ready", load_seconds=round(time.perf_counter() - started, 3))
+            print(f"[reranker] {MODEL_NAME} loaded in {_state['load_seconds']}s")
+    return _reranker
+
+def rerank_many(queries: List[str], candidates: List[List[Dict[str, Any]]], top_k: int) -> List[List[Dict[str, Any]]]:
+    """
+    Второй этап поиска: пары (запрос, кандидат) всех запросов оцениваются кросс-энкодером
+    одним вызовом predict батчами по RERANK_BATCH_SIZE, каждый список пересортировывается и обрезается до top_k.
+    Результат кэшируется по запросу и набору кандидатов.
+    """
+    results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+    todo = []
+    for i, (query_text, docs) in enumerate(zip(queries, candidates)):
+        if not docs:
+            continue
+        key = rerank_cache.make_key("rerank", MODEL_NAME, query_text, [d["text"] for d in docs], top_k=top_k)
+        cached = rerank_cache.get(key)
+        if cached is not None:
+            results[i] = cached
+            with _stats_lock:
+                _latency["cache_hits"] += 1
+        else:
+            todo.append((i, key))
+    if not todo:
+        return results
+
+    pairs = [(queries[i], doc["text"]) for i, _ in todo for doc in candidates[i]]
+    started = time.perf_counter()
+    scores = get_reranker().predict(pairs, batch_size=_settings['batch_size'], show_progress_bar=False)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    offset = 0
+    for i, key in todo:
+        docs = candidates[i]
+        doc_scores = scores[offset:offset + len(docs)]
+        offset += len(docs)
+        ranked = sorted(zip(docs, doc_scores), key=lambda item: item[1], reverse=True)[:top_k]
+        results[i] = [{"text": doc["text"], "score": float(score)} for doc, score in ranked]
+        rerank_cache.set(key, results[i])
+
+    with _stats_lock:
+        _latency["calls"] += 1
+        _latency["queries"] += len(todo)
+        _latency["pairs"] += len(pairs)
+        _latency["total_ms"] += elapsed_ms
+        _latency["max_ms"] = max(_latency["max_ms"], elapsed_ms)
+    return results
+
+def reranker_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        latency = dict(_latency)
+    calls = latency["calls"]
+    return {
+        "model": MODEL_NAME,
+        **_state,
+        "calls": calls,
+        "queries": latency["queries"],
+        "cache_hits": latency["cache_hits"],
+        "pairs": latency["pairs"],
+        "avg_ms": round(latency["total_ms"] / calls, 2) if calls else 0.0,
+        "max_ms": round(latency["max_ms"], 2),
+        "cache": rerank_cache.stats(),
+    }
@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# самые частые окончания русских слов: "шрифта", "шрифтов" и "шрифты" сводятся к "шрифт"
+RU_ENDINGS = sorted((
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ой", "ей", "ий", "ый", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ую", "юю",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+), key=len, reverse=True)
+MIN_STEM = 4
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        for ending in RU_ENDINGS:
+            if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM:
+                token = token[:-len(ending)]
+                break
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    Лексический индекс BM25 в памяти процесса для точных терминов, которые плохо ловит
+    маленькая dense-модель. Документы ключуются id точки векторного хранилища (без id — самим текстом):
+    повторное добавление того же текста игнорируется, новый текст под старым id заменяет прежний.
+    Если задан path, записи {"id", "text"} дописываются в JSONL-файл, при старте действует последняя
+    запись для каждого id, а файл с заменёнными записями переписывается начисто.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._texts: List[str] = []
+        self._ids: List[Hashable] = []
+        self._known: Dict[Hashable, int] = {}
+        self._doc_lengths: List[int] = []
+        self._total_length = 0
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+            self._add([row["text"] for row in rows], [row.get("id", row["text"]) for row in rows])
+            if len(rows) > len(self._texts):
+                self._rewrite()
+
+    def add(self, texts: List[str], ids: Optional[Sequence[Optional[Hashable]]] = None) -> None:
+        with self._lock:
+            added = self._add(texts, ids if ids is not None else texts)
+            if self.path and added:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for doc in added:
+                        f.write(self._record(doc))
+
+    def search(self, query_text: str, top_k: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            n_docs = len(self._texts)
+            if not n_docs or top_k <= 0:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query_text)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [{"text": self._texts[doc], "score": score} for doc, score in ranked]
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def _add(self, texts: List[str], ids: Sequence[Optional[Hashable]]) -> List[int]:
+        added = []
+        for text, point_id in zip(texts, ids):
+            if point_id is None:
+                point_id = text
+            doc = self._known.get(point_id)
+            if doc is None:
+                doc = len(self._texts)
+                self._known[point_id] = doc
+                self._ids.append(point_id)
+                self._texts.append(text)
+                self._doc_lengths.append(0)
+            elif self._texts[doc] == text:
+                continue
+            else:
+                # upsert с новым текстом: постинги старого текста убираются, слот документа переиспользуется
+                self._remove_postings(doc)
+                self._texts[doc] = text
+            terms = tokenize(text)
+            self._doc_lengths[doc] = len(terms)
+            self._total_length += len(terms)
+            for term, tf in Counter(terms).items():
+                self._postings.setdefault(term, {})[doc] = tf
+            added.append(doc)
+        return added
+
+    def _remove_postings(self, doc: int):
+        for term in set(tokenize(self._texts[doc])):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths[doc]
+
+    def _record(self, doc: int) -> str:
+        return json.dumps({"id": self._ids[doc], "text": self._texts[doc]}, ensure_ascii=False) + "\n"
+
+    def _rewrite(self):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for doc in range(len(self._texts)):
+                f.write(self._record(doc))
+        os.replace(self.path + ".tmp", self.path)
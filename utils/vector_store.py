@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Set
+
+import numpy as np
+
+from core.config import get_qdrant_api_key, get_qdrant_url, get_vector_store_settings
+
+
+class VectorStore(ABC):
+    """
+    Интерфейс векторного хранилища для RAG. Векторы — нормализованные эмбеддинги,
+    score в результатах — косинусная близость (больше — релевантнее).
+    """
+
+    @abstractmethod
+    def upsert(self, ids: Sequence[Optional[Hashable]], vectors: Sequence[Sequence[float]],
+               payloads: Sequence[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def search(self, vector: Sequence[float], top_k: int) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def search_batch(self, vectors: Sequence[Sequence[float]], top_k: int) -> List[List[Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def existing_ids(self, ids: Sequence[Hashable]) -> Set[Hashable]:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    def flush(self) -> None:
+        pass
+
+
+class QdrantVectorStore(VectorStore):
+
+    def __init__(self, collection_name: str, dim: int, url: str, api_key: str):
+        from qdrant_client import QdrantClient
+        from qdrant_client.models import Distance, VectorParams
+
+        self.collection_name = collection_name
+        self.client = QdrantClient(url=url, api_key=api_key)
+
+        if not self.client.collection_exists(self.collection_name):
+            vector_params = VectorParams(size=dim, distance=Distance.COSINE)
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=vector_params
+            )
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        from qdrant_client.models import PointStruct
+
+        points = [
+            PointStruct(id=point_id, vector=list(vec), payload=payload)
+            for point_id, vec, payload in zip(ids, vectors, payloads)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def search(self, vector, top_k: int) -> List[Dict[str, Any]]:
+        search_result = self.client.query_points(
+            collection_name=self.collection_name,
+            query=list(vector),
+            limit=top_k
+        )
+        return [
+            {"id": point.id, "score": point.score, "payload": point.payload or {}}
+            for point in search_result.points
+        ]
+
+    def search_batch(self, vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        from qdrant_client.models import QueryRequest
+
+        if not vectors:
+            return []
+        # все запросы уходят одним HTTP-вызовом
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[QueryRequest(query=list(vec), limit=top_k, with_payload=True) for vec in vectors]
+        )
+        return [
+            [{"id": point.id, "score": point.score, "payload": point.payload or {}} for point in response.points]
+            for response in responses
+        ]
+
+    def existing_ids(self, ids) -> Set[Hashable]:
+        records = self.client.retrieve(
+            collection_name=self.collection_name, ids=list(ids), with_payload=False, with_vectors=False
+        )
+        return {record.id for record in records}
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection_name, exact=True).count
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Точный косинусный поиск в процессе: все векторы — одна float32-матрица, запрос — одно умножение.
+    Если задан directory, матрица сохраняется в vectors.npy и при старте открывается через mmap,
+    id и payload лежат рядом в meta.jsonl.
+    """
+
+    def __init__(self, dim: int, directory: Optional[str] = None):
+        self.dim = dim
+        self.directory = directory
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids: List[Hashable] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        if directory:
+            self._load()
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        self._upsert_rows(ids, vectors, payloads)
+
+    def _upsert_rows(self, ids, vectors, payloads) -> List[int]:
+        matrix = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if not self._vectors.flags.writeable:
+                # матрица открыта через mmap только для чтения — переносим в память перед изменением
+                self._vectors = np.array(self._vectors)
+            touched, appended = [], []
+            for point_id, vec, payload in zip(ids, matrix, payloads):
+                if point_id is None:
+                    point_id = len(self._ids)
+                    while point_id in self._positions:
+                        point_id += 1
+                position = self._positions.get(point_id)
+                if position is None:
+                    position = len(self._ids)
+                    self._positions[point_id] = position
+                    self._ids.append(point_id)
+                    self._payloads.append(payload)
+                    appended.append(vec)
+                else:
+                    self._vectors[position] = vec
+                    self._payloads[position] = payload
+                touched.append(position)
+            if appended:
+                self._vectors = np.vstack([self._vectors, np.stack(appended)])
+            self._dirty = True
+            return touched
+
+    def search(self, vector, top_k: int) -> List[Dict[str, Any]]:
+        return self.search_batch([vector], top_k)[0]
+
+    def search_batch(self, vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        queries = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if not self._ids or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            scores = queries @ self._vectors.T
+            k = min(top_k, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for row, candidates in zip(scores, top):
+                ordered = candidates[np.argsort(-row[candidates])]
+                results.append([self._hit(int(pos), float(row[pos])) for pos in ordered])
+            return results
+
+    def existing_ids(self, ids) -> Set[Hashable]:
+        with self._lock:
+            return {point_id for point_id in ids if point_id in self._positions}
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def flush(self) -> None:
+        if not self.directory:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            vectors_path = os.path.join(self.directory, "vectors.npy")
+            meta_path = os.path.join(self.directory, "meta.jsonl")
+            np.save(vectors_path + ".tmp.npy", self._vectors)
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                for point_id, payload in zip(self._ids, self._payloads):
+                    f.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n")
+            os.replace(vectors_path + ".tmp.npy", vectors_path)
+            os.replace(meta_path + ".tmp", meta_path)
+            self._dirty = False
+
+    def _hit(self, position: int, score: float) -> Dict[str, Any]:
+        return {"id": self._ids[position], "score": score, "payload": self._payloads[position]}
+
+    def _load(self):
+        vectors_path = os.path.join(self.directory, "vectors.npy")
+        meta_path = os.path.join(self.directory, "meta.jsonl")
+        if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+            return
+        self._vectors = np.load(vectors_path, mmap_mode="r")
+        with open(meta_path, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                self._positions[row["id"]] = len(self._ids)
+                self._ids.append(row["id"])
+                self._payloads.append(row["payload"])
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class HnswVectorStore(NumpyVectorStore):
+    """
+    Приближённый поиск (HNSW, hnswlib) поверх того же хранения, что и NumpyVectorStore.
+    Пока векторов меньше threshold, поиск точный; индекс строится лениво и дополняется
+    изменёнными строками, на диске сохраняется в hnsw.bin.
+    """
+
+    def __init__(self, dim: int, directory: Optional[str] = None, threshold: int = 20000,
+                 m: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("Для VECTOR_STORE=hnsw установите пакет hnswlib") from e
+        self._hnswlib = hnswlib
+        self.threshold = threshold
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+        self._stale_rows: set = set()
+        super().__init__(dim, directory)
+        self._stale_rows = set(range(len(self._ids)))
+        self._load_index()
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        touched = self._upsert_rows(ids, vectors, payloads)
+        with self._lock:
+            self._stale_rows.update(touched)
+
+    def search_batch(self, vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        with self._lock:
+            if len(self._ids) < self.threshold:
+                return super().search_batch(vectors, top_k)
+            self._sync_index()
+            queries = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+            k = min(top_k, len(self._ids))
+            labels, distances = self._index.knn_query(queries, k=k)
+            return [
+                [self._hit(int(pos), 1.0 - float(dist)) for pos, dist in zip(row_labels, row_distances)]
+                for row_labels, row_distances in zip(labels, distances)
+            ]
+
+    def flush(self) -> None:
+        with self._lock:
+            super().flush()
+            if self.directory and self._index is not None:
+                self._sync_index()
+                self._index.save_index(os.path.join(self.directory, "hnsw.bin"))
+
+    def _sync_index(self):
+        if self._index is None:
+            self._index = self._hnswlib.Index(space="cosine", dim=self.dim)
+            self._index.init_index(max_elements=max(1024, len(self._ids) * 2), M=self.m,
+                                   ef_construction=self.ef_construction, allow_replace_deleted=False)
+            self._stale_rows = set(range(len(self._ids)))
+        if not self._stale_rows:
+            return
+        if len(self._ids) > self._index.get_max_elements():
+            self._index.resize_index(len(self._ids) * 2)
+        rows = np.fromiter(sorted(self._stale_rows), dtype=np.int64)
+        self._index.add_items(np.asarray(self._vectors[rows]), rows)
+        self._index.set_ef(self.ef_search)
+        self._stale_rows.clear()
+
+    def _load_index(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, "hnsw.bin")
+        if not os.path.exists(path) or not self._ids:
+            return
+        index = self._hnswlib.Index(space="cosine", dim=self.dim)
+        index.load_index(path, max_elements=len(self._ids) * 2)
+        if index.get_current_count() == len(self._ids):
+            self._index = index
+            self._index.set_ef(self.ef_search)
+            self._stale_rows.clear()
+
+
+def create_vector_store(collection_name: str, dim: int) -> VectorStore:
+    """
+    Выбор бэкенда по VECTOR_STORE: qdrant, numpy, hnsw или auto
+    (Qdrant, если заданы QDRANT_URL и QDRANT_API_KEY, иначе локальный numpy-индекс).
+    """
+    settings = get_vector_store_settings()
+    backend = settings['backend']
+    api_url = get_qdrant_url()
+    api_token = get_qdrant_api_key()
+
+    if backend == 'auto':
+        backend = 'qdrant' if api_url and api_token else 'numpy'
+
+    if backend == 'qdrant':
+        if not api_url or not api_token:
+            raise ValueError("Не заданы QDRANT_API_URL или QDRANT_API_TOKEN")
+        return QdrantVectorStore(collection_name, dim, api_url, api_token)
+
+    directory = os.path.join(settings['directory'], collection_name) if settings['directory'] else None
+    if backend == 'hnsw':
+        return HnswVectorStore(dim, directory, threshold=settings['hnsw_threshold'])
+    if backend == 'numpy':
+        return NumpyVectorStore(dim, directory)
+    raise ValueError(f"Неизвестный VECTOR_STORE: {backend}")